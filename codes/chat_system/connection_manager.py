@@ -1,4 +1,4 @@
-from typing import Dict, List, Set, Optional, Any, Tuple
+from typing import Dict, List, Set, Optional, Any, Tuple, Union
 import json
 import asyncio
 import logging
@@ -15,16 +15,40 @@ try:
     import redis.asyncio as redis_async
     REDIS_AVAILABLE = True
 except ImportError:
-    # 如果导入失败，main.py中已提供了AsyncRedisWrapper的实现
-    from main import AsyncRedisWrapper
+    # 如果导入失败，使用redis_compat中基于同步客户端的兼容层
+    from redis_compat import AsyncRedisWrapper
     redis_async = AsyncRedisWrapper
     REDIS_AVAILABLE = False
 
+# orjson支持 - 可选，不可用时回退到标准json
+# WebSocket客户端（浏览器）按文本帧解析JSON，因此序列化结果仍解码为str发送
+try:
+    import orjson
+    
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+    
+    loads = orjson.loads
+    ORJSON_AVAILABLE = True
+except ImportError:
+    dumps = json.dumps
+    loads = json.loads
+    ORJSON_AVAILABLE = False
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, 
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("ConnectionManager")
 
+# 单次WebSocket发送超时（秒），超时的连接由其发送任务关闭
+SEND_TIMEOUT = 5.0
+# 每个连接的出站消息队列长度，队列满说明客户端消费过慢，将被断开
+OUTBOUND_QUEUE_SIZE = 32
+# 每个房间消息流（room:{room_id}:stream）保留的消息数，写入时近似裁剪
+ROOM_HISTORY_SIZE = 100
+# 连接统计信息的缓存时间（秒），首页和健康检查频繁访问时不必每次遍历所有房间
+CONNECTION_STATS_TTL = 1.0
+
 class ConnectionManager:
     """
     WebSocket连接管理器，负责处理多个客户端连接、消息广播和用户状态管理
@@ -50,6 +74,8 @@ class ConnectionManager:
             cls._instance.current_connections = 0
             cls._instance.is_degraded = False
             cls._instance.healthy = True
+            cls._instance._stats_cache = None
+            cls._instance._stats_cache_time = 0.0
         return cls._instance
     
     async def initialize(self, redis_conn = None):
@@ -107,7 +133,7 @@ class ConnectionManager:
                         )
                         
                         if message and message["type"] == "message":
-                            data = json.loads(message["data"])
+                            data = loads(message["data"])
                             # 只处理来自其他节点的消息，避免重复广播
                             if data.get("source_node") != self.node_id:
                                 await self._broadcast_from_redis(data)
@@ -141,7 +167,7 @@ class ConnectionManager:
             
             # 降级处理：拒绝新连接或限制某些功能
             await websocket.accept()
-            await websocket.send_text(json.dumps({
+            await websocket.send_text(dumps({
                 "type": "system",
                 "content": "服务器负载过高，已进入降级模式，部分功能可能受限",
                 "timestamp": time.time()
@@ -152,11 +178,17 @@ class ConnectionManager:
             # 接受WebSocket连接
             await websocket.accept()
             
+            # 每个连接一个有界出站队列和发送任务，广播只做入队，慢客户端不会阻塞其他客户端
+            websocket._out_q = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+            websocket._relay = asyncio.create_task(self._relay(websocket))
+            
             # 计算用户分片索引
             shard_index = self._get_shard_index(user_id)
             
-            # 初始化用户连接字典
-            self.connection_shards[shard_index][user_id][room_id] = websocket
+            # 初始化用户连接字典；同一用户在同一房间重连或多开时，新连接取代旧连接
+            user_connections = self.connection_shards[shard_index][user_id]
+            previous = user_connections.get(room_id)
+            user_connections[room_id] = websocket
             
             # 更新用户-房间映射
             if user_id not in self.user_room_map:
@@ -168,8 +200,13 @@ class ConnectionManager:
                 self.room_user_map[room_id] = set()
             self.room_user_map[room_id].add(user_id)
             
-            # 递增连接计数
-            self.current_connections += 1
+            if previous is None:
+                # 递增连接计数
+                self.current_connections += 1
+            else:
+                # 取代旧连接时连接数不变；旧连接的发送任务退出时将其关闭，
+                # 之后其接收循环调用disconnect时映射中已不是该连接，不会移除新连接或重复计数
+                self._stop_relay(previous)
             
             logger.info(f"用户 {user_id} 连接到房间 {room_id}, 当前连接数: {self.current_connections}")
             
@@ -196,21 +233,30 @@ class ConnectionManager:
             return True
         except Exception as e:
             logger.error(f"建立连接失败: {e}")
+            self._stop_relay(websocket)
             return False
     
     async def disconnect(self, websocket: WebSocket, user_id: str, room_id: str):
         """断开WebSocket连接"""
         try:
+            # 停止该连接的发送任务
+            self._stop_relay(websocket)
+            
             # 计算用户分片索引
             shard_index = self._get_shard_index(user_id)
             
+            # 只移除该连接本身：连接已被同一用户的新连接取代，或慢连接被提前断开后
+            # 接收循环退出时再次调用，都不能影响映射和连接计数
+            user_connections = self.connection_shards[shard_index].get(user_id)
+            if user_connections is None or user_connections.get(room_id) is not websocket:
+                return True
+            
             # 移除连接对象
-            if user_id in self.connection_shards[shard_index] and room_id in self.connection_shards[shard_index][user_id]:
-                del self.connection_shards[shard_index][user_id][room_id]
-                
-                # 如果用户没有其他连接，清理映射
-                if not self.connection_shards[shard_index][user_id]:
-                    del self.connection_shards[shard_index][user_id]
+            del user_connections[room_id]
+            
+            # 如果用户没有其他连接，清理映射
+            if not user_connections:
+                del self.connection_shards[shard_index][user_id]
             
             # 更新用户-房间映射
             if user_id in self.user_room_map:
@@ -252,40 +298,96 @@ class ConnectionManager:
             logger.error(f"断开连接失败: {e}")
             return False
     
+    async def _relay(self, websocket: WebSocket):
+        """连接专属的发送任务：按顺序发送出站队列中的消息，发送失败时关闭连接"""
+        queue = websocket._out_q
+        try:
+            while True:
+                message = await queue.get()
+                # 不使用全局并发上限：背压由有界出站队列和发送超时按连接各自承担，
+                # 卡住的客户端只阻塞自己的发送任务
+                await asyncio.wait_for(websocket.send_text(message), timeout=SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            # 连接被移除（断开、被新连接取代或消费过慢）时由发送任务自己关闭连接，
+            # 关闭过程由该任务持有，不需要额外创建任务
+            await self._close_quietly(websocket)
+            raise
+        except Exception as e:
+            logger.debug(f"连接发送失败，关闭连接: {e!r}")
+            await self._close_quietly(websocket)
+    
+    def _stop_relay(self, websocket: WebSocket):
+        """取消连接的发送任务（如果存在），发送任务退出前会关闭连接"""
+        relay = getattr(websocket, "_relay", None)
+        if relay is not None:
+            relay.cancel()
+    
+    async def _close_quietly(self, websocket: WebSocket):
+        """关闭连接并忽略错误，接收循环随之退出并走正常的断开流程"""
+        try:
+            await asyncio.wait_for(websocket.close(code=1008), timeout=SEND_TIMEOUT)
+        except Exception:
+            pass
+    
+    def _enqueue(self, websocket: WebSocket, message: str) -> bool:
+        """将消息放入连接的出站队列，队列已满时返回False"""
+        try:
+            websocket._out_q.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+    
+    async def _drop_slow_connections(self, slow: List[Tuple[str, str, WebSocket]]):
+        """断开出站队列已满的慢连接"""
+        for user_id, room_id, websocket in slow:
+            logger.warning(f"客户端消费过慢，出站队列已满，断开连接 {user_id}/{room_id}")
+            # disconnect会停止该连接的发送任务，由发送任务关闭连接
+            await self.disconnect(websocket, user_id, room_id)
+    
+    async def send_to_connection(self, websocket: WebSocket, user_id: str, room_id: str, message: str) -> bool:
+        """将消息放入单个连接的出站队列，队列已满时按慢连接断开，返回是否成功入队"""
+        if self._enqueue(websocket, message):
+            return True
+        await self._drop_slow_connections([(user_id, room_id, websocket)])
+        return False
+    
     async def send_personal_message(self, user_id: str, message: str):
         """发送个人消息"""
         # 获取用户的分片索引
         shard_index = self._get_shard_index(user_id)
         
         if user_id in self.connection_shards[shard_index]:
-            failed_rooms = []
-            for room_id, websocket in self.connection_shards[shard_index][user_id].items():
-                try:
-                    if websocket.client_state != WebSocketState.DISCONNECTED:
-                        await websocket.send_text(message)
-                except Exception as e:
-                    logger.error(f"发送个人消息失败 {user_id}/{room_id}: {e}")
-                    failed_rooms.append(room_id)
-            
-            # 清理失败的连接
-            for room_id in failed_rooms:
-                if room_id in self.connection_shards[shard_index][user_id]:
-                    await self.disconnect(
-                        self.connection_shards[shard_index][user_id][room_id], 
-                        user_id, 
-                        room_id
-                    )
-            
+            slow = [
+                (user_id, room_id, websocket)
+                for room_id, websocket in self.connection_shards[shard_index][user_id].items()
+                if websocket.client_state != WebSocketState.DISCONNECTED and not self._enqueue(websocket, message)
+            ]
+            if slow:
+                await self._drop_slow_connections(slow)
             return True
         return False
     
-    async def broadcast_to_room(self, room_id: str, message: str):
-        """广播消息到指定房间，使用队列提高性能"""
+    async def broadcast_to_room(self, room_id: str, message: Union[str, bytes]):
+        """广播消息到指定房间，使用队列提高性能，message可以是已编码的JSON字节串"""
         # 使用广播队列处理房间消息
         queue_index = self._get_broadcast_queue_index(room_id)
         await self.broadcast_queues[queue_index].put((room_id, message))
         return True
     
+    def broadcast_nowait(self, room_id: str, message: str) -> int:
+        """直接将系统通知放入房间内各连接的出站队列，不经过广播队列，返回投递的连接数
+        
+        用于服务端生成的欢迎/离开等低价值通知：消息已知合法，无需广播处理器解析校验；
+        出站队列已满的连接直接跳过这条通知，不因此断开连接
+        """
+        delivered = 0
+        for user_id in self.room_user_map.get(room_id, ()):
+            websocket = self.connection_shards[self._get_shard_index(user_id)].get(user_id, {}).get(room_id)
+            if (websocket is not None and websocket.client_state != WebSocketState.DISCONNECTED
+                    and self._enqueue(websocket, message)):
+                delivered += 1
+        return delivered
+    
     async def broadcast_processor(self, queue_index: int):
         """广播队列处理器"""
         while self.processing_messages:
@@ -295,7 +397,7 @@ class ConnectionManager:
                 
                 # 添加调试日志
                 try:
-                    msg_data = json.loads(message)
+                    msg_data = loads(message)
                     msg_room = msg_data.get("room", "unknown")
                     msg_type = msg_data.get("type", "unknown")
                     
@@ -309,9 +411,12 @@ class ConnectionManager:
                     # 确保消息总是包含正确的房间ID
                     if msg_room == "unknown" or not msg_room:
                         msg_data["room"] = room_id
-                        message = json.dumps(msg_data)
+                        message = dumps(msg_data)
+                    elif isinstance(message, bytes):
+                        # 预编码的字节串只解码一次，所有客户端共用同一个文本帧
+                        message = message.decode()
                     
-                    logger.debug(f"处理广播消息: room={room_id}, type={msg_type}")
+                    logger.debug("处理广播消息: room=%s, type=%s", room_id, msg_type)
                 except Exception as e:
                     logger.warning(f"解析广播消息时出错: {e}")
                     # JSON解析错误时，标记任务完成并跳过
@@ -319,8 +424,8 @@ class ConnectionManager:
                     continue
                 
                 if room_id in self.room_user_map:
-                    disconnected_users = []
-                    
+                    # 同一个已编码的消息放入房间内每个连接的出站队列，由各连接的发送任务写出
+                    slow = []
                     for user_id in self.room_user_map[room_id]:
                         # 获取用户的分片索引
                         shard_index = self._get_shard_index(user_id)
@@ -328,23 +433,12 @@ class ConnectionManager:
                         if (user_id in self.connection_shards[shard_index] and 
                             room_id in self.connection_shards[shard_index][user_id]):
                             websocket = self.connection_shards[shard_index][user_id][room_id]
-                            try:
-                                if websocket.client_state != WebSocketState.DISCONNECTED:
-                                    await websocket.send_text(message)
-                            except Exception as e:
-                                logger.error(f"向房间广播失败 {user_id}/{room_id}: {e}")
-                                disconnected_users.append((user_id, room_id))
+                            if websocket.client_state != WebSocketState.DISCONNECTED and not self._enqueue(websocket, message):
+                                slow.append((user_id, room_id, websocket))
                     
-                    # 清理断开的连接
-                    for user_id, room_id in disconnected_users:
-                        shard_index = self._get_shard_index(user_id)
-                        if (user_id in self.connection_shards[shard_index] and 
-                            room_id in self.connection_shards[shard_index][user_id]):
-                            await self.disconnect(
-                                self.connection_shards[shard_index][user_id][room_id],
-                                user_id,
-                                room_id
-                            )
+                    # 清理消费过慢的连接
+                    if slow:
+                        await self._drop_slow_connections(slow)
                 
                 # 标记广播任务完成
                 self.broadcast_queues[queue_index].task_done()
@@ -405,7 +499,7 @@ class ConnectionManager:
                     message["room"] = room_id
                 
                 # 消息序列化
-                message_json = json.dumps(message)
+                message_json = dumps(message)
                 
                 # 根据消息类型处理
                 if message["type"] in ["chat", "text"]:  # 支持两种类型名称
@@ -468,31 +562,22 @@ class ConnectionManager:
                 except (ValueError, TypeError):
                     timestamp = time.time()
             
-            # 生成消息ID
-            msg_id = f"{room_id}:{int(timestamp * 1000)}:{message.get('user_id', 'system')}"
-            
-            # 使用哈希表存储消息内容
-            mapping = {
+            # 追加到房间消息流，消息ID由Redis生成，写入时近似裁剪到ROOM_HISTORY_SIZE条
+            fields = {
                 "content": str(message.get("content", "")),
                 "sender": str(message.get("user_id", "system")),
                 "type": str(message.get("type", "text")),
-                "timestamp": str(timestamp)
+                "timestamp": timestamp
             }
             
-            # 使用超时机制
-            async def save_message():
-                # 存储消息内容
-                await self.redis_client.hset(f"message:{msg_id}", mapping=mapping)
-                
-                # 使用有序集合保存消息ID，以时间戳为分数
-                await self.redis_client.zadd(f"room:{room_id}:messages", {msg_id: timestamp})
-                
-                # 限制消息数量，保留最新的1000条
-                await self.redis_client.zremrangebyrank(f"room:{room_id}:messages", 0, -1001)
-            
             # 设置超时，避免阻塞
             try:
-                await asyncio.wait_for(save_message(), timeout=1.0)
+                await asyncio.wait_for(
+                    self.redis_client.xadd(
+                        f"room:{room_id}:stream", fields, maxlen=ROOM_HISTORY_SIZE, approximate=True
+                    ),
+                    timeout=1.0
+                )
             except asyncio.TimeoutError:
                 # 忽略超时，不阻塞主流程
                 return
@@ -509,13 +594,19 @@ class ConnectionManager:
             if not self.redis_client:
                 return
             
-            # 确保消息有时间戳
-            timestamp = message.get("timestamp", time.time())
+            # 确保消息有时间戳；缺失或非法时用纳秒时间，毫秒部分走整数除法
+            timestamp = message.get("timestamp")
             if not isinstance(timestamp, (int, float)):
                 try:
                     timestamp = float(timestamp)
                 except (ValueError, TypeError):
-                    timestamp = time.time()
+                    timestamp = None
+            if timestamp is None:
+                ns = time.time_ns()
+                timestamp = ns / 1e9
+                timestamp_ms = ns // 1_000_000
+            else:
+                timestamp_ms = int(timestamp * 1000)
             
             # 获取对话双方用户ID
             user1 = message.get("user_id", "unknown")
@@ -530,7 +621,7 @@ class ConnectionManager:
                 user1, user2 = user2, user1
             
             # 生成消息ID
-            msg_id = f"private:{user1}:{user2}:{int(timestamp * 1000)}"
+            msg_id = f"private:{user1}:{user2}:{timestamp_ms}"
             
             # 使用哈希表存储消息内容
             mapping = {
@@ -538,7 +629,7 @@ class ConnectionManager:
                 "sender": str(message.get("user_id", "system")),
                 "receiver": str(message.get("target", "")),
                 "type": "private",
-                "timestamp": str(timestamp)
+                "timestamp": timestamp
             }
             
             # 异步存储，带超时保护
@@ -573,41 +664,22 @@ class ConnectionManager:
                 # 使用超时机制
                 async def fetch_history():
                     messages = []
-                    # 使用有序集合而不是列表
-                    key = f"room:{room_id}:messages"
-                    # 获取消息ID
-                    msg_ids = await self.redis_client.zrevrange(key, 0, limit - 1)
+                    # 从房间消息流倒序取出最新的limit条消息，消息ID和内容一次返回
+                    entries = await self.redis_client.xrevrange(f"room:{room_id}:stream", count=limit)
                     
-                    for msg_id in msg_ids:
-                        # 处理可能的bytes类型
-                        if isinstance(msg_id, bytes):
-                            msg_id_str = msg_id.decode('utf-8')
-                        else:
-                            msg_id_str = str(msg_id)
-                            
-                        # 获取消息详情
-                        msg_data = await self.redis_client.hgetall(f"message:{msg_id_str}")
-                        if msg_data:
-                            # 处理bytes类型
-                            msg_dict = {}
-                            for k, v in msg_data.items():
-                                if isinstance(k, bytes):
-                                    k = k.decode('utf-8')
-                                if isinstance(v, bytes):
-                                    v = v.decode('utf-8')
-                                msg_dict[k] = v
+                    for msg_id, msg_dict in reversed(entries):
+                        # 尝试转换时间戳
+                        try:
+                            msg_dict["timestamp"] = float(msg_dict.get("timestamp", 0))
+                        except (ValueError, TypeError):
+                            msg_dict["timestamp"] = 0
                             
-                            # 尝试转换时间戳
-                            try:
-                                msg_dict["timestamp"] = float(msg_dict.get("timestamp", 0))
-                            except (ValueError, TypeError):
-                                msg_dict["timestamp"] = 0
-                                
-                            msg_dict["room"] = room_id
-                            msg_dict["id"] = msg_id_str
-                            messages.append(msg_dict)
+                        msg_dict["room"] = room_id
+                        msg_dict["id"] = msg_id
+                        messages.append(msg_dict)
                     
-                    return sorted(messages, key=lambda x: x.get("timestamp", 0))
+                    # 消息流按写入顺序排列，已是时间顺序
+                    return messages
                 
                 # 设置超时，避免阻塞
                 return await asyncio.wait_for(fetch_history(), timeout=2.0)
@@ -821,7 +893,7 @@ class ConnectionManager:
                             await self.redis_client.hset(
                                 "nodes:status",
                                 self.node_id,
-                                json.dumps({
+                                dumps({
                                     "healthy": self.healthy,
                                     "is_degraded": self.is_degraded,
                                     "connections": self.current_connections,
@@ -885,9 +957,13 @@ class ConnectionManager:
         logger.info("连接管理器已关闭")
     
     async def get_connection_stats(self) -> Dict:
-        """获取连接统计信息"""
+        """获取连接统计信息，结果缓存CONNECTION_STATS_TTL秒"""
+        now = time.monotonic()
+        if self._stats_cache is not None and now - self._stats_cache_time < CONNECTION_STATS_TTL:
+            return self._stats_cache
+        
         total_connections = sum(len(users) for users in self.room_user_map.values())
-        return {
+        self._stats_cache = {
             "total_connections": total_connections,
             "active_rooms": len(self.room_user_map),
             "queue_size": self.message_queue.qsize(),
@@ -895,6 +971,8 @@ class ConnectionManager:
             "healthy": self.healthy,
             "node_id": self.node_id
         }
+        self._stats_cache_time = now
+        return self._stats_cache
     
     async def broadcast_system_message(self, message: str) -> bool:
         """
@@ -916,7 +994,7 @@ class ConnectionManager:
             }
             
             # 将消息转换为JSON字符串
-            message_json = json.dumps(system_msg)
+            message_json = dumps(system_msg)
             
             # 为每个活跃的聊天室创建广播任务
             broadcast_tasks = []
@@ -952,7 +1030,7 @@ class ConnectionManager:
             room_id = message.get("room_id")
             
             # 根据消息类型处理
-            message_json = json.dumps(message)
+            message_json = dumps(message)
             
             if message_type == "private":
                 # 私信消息
@@ -12,8 +12,8 @@ try:
     import redis.asyncio as redis_async
     REDIS_AVAILABLE = True
 except ImportError:
-    # 如果导入失败，main.py中已提供了AsyncRedisWrapper的实现
-    from main import AsyncRedisWrapper
+    # 如果导入失败，使用redis_compat中基于同步客户端的兼容层
+    from redis_compat import AsyncRedisWrapper
     redis_async = AsyncRedisWrapper
     REDIS_AVAILABLE = False
 
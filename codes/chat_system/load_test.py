@@ -1,17 +1,27 @@
 import asyncio
 import json
 import logging
-import random
+import os
 import string
 import time
+import zlib
 import argparse
+import array
+import csv
+import multiprocessing
+import queue
+import re
+import sys
 from contextlib import suppress
 from typing import Dict, List
 
 import aiohttp
 import websockets
-import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
+import matplotlib
+# 在导入其他matplotlib模块前设置非交互式后端，避免无界面环境下的后端探测
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
 from tqdm import tqdm
 
 # 配置日志
@@ -19,6 +29,28 @@ logging.basicConfig(level=logging.INFO,
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("LoadTest")
 
+# orjson支持 - 可选，不可用时回退到标准json
+try:
+    import orjson
+    
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+    
+    ORJSON_AVAILABLE = True
+except ImportError:
+    dumps = json.dumps
+    ORJSON_AVAILABLE = False
+
+# uvloop支持 - 可选（Windows等平台不可用时回退到标准事件循环）
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+# asyncio.TaskGroup需要Python 3.11+，低版本回退到gather
+TASKGROUP_AVAILABLE = sys.version_info >= (3, 11)
+
 # 测试配置默认参数
 DEFAULT_CONFIG = {
     "ws_server_url": "ws://localhost:8000/ws/{room_id}",
@@ -30,8 +62,39 @@ DEFAULT_CONFIG = {
     "test_duration": 60,  # 测试持续时间(秒)
     "ping_interval": 30.0,  # 心跳间隔(秒)
     "random_seed": 42,  # 随机种子
+    "workers": 1,  # 负载生成进程数
+    "user_offset": 0,  # 用户编号起始偏移（多进程时按进程划分）
+    "events_csv": "load_test_events.csv",  # 详细事件日志文件
+    "skip_charts": None,  # 是否跳过图表生成，None表示按连接数自动决定
 }
 
+# 连接数超过该阈值时默认跳过图表生成，改为导出原始数据
+CHART_AUTO_SKIP_CONNECTIONS = 5000
+
+# 跳过图表时导出的原始数据文件（np.savez_compressed），包含以下数组：
+#   connect_times  float32  每个成功连接的建立耗时(ms)
+#   latencies      int64    消息延迟(us)，基于单调时钟
+#   ts_connect     float64  连接建立事件的时间戳(time.time()，秒)
+#   ts_disconnect  float64  主动断开事件的时间戳
+#   ts_closed      float64  服务端关闭连接事件的时间戳
+#   ts_send        float64  消息发送事件的时间戳
+#   ts_recv        float64  消息接收事件的时间戳
+#   start_time     float64  测试开始时间戳（标量）
+RAW_DATA_PATH = "load_test_raw.npz"
+
+# 多进程模式下由各工作进程汇总回主进程的计数指标
+SUMMED_STATS = (
+    "connections_sent",
+    "connections_active",
+    "connections_failed",
+    "connections_closed",
+    "messages_sent",
+    "messages_received",
+    "errors",
+    "events_dropped",
+    "latencies_dropped",
+)
+
 # 测试统计指标
 test_stats = {
     "start_time": 0,
@@ -42,64 +105,229 @@ test_stats = {
     "messages_sent": 0,
     "messages_received": 0,
     "errors": 0,
-    "latencies": [],  # 消息延迟(ms)
-    "connect_times": [],  # 连接建立时间(ms)
+    "events_dropped": 0,  # 事件队列满时丢弃的事件数
+    "latencies": np.empty(0, dtype=np.int64),  # 消息延迟(us)，基于单调时钟
+    "connect_times": np.empty(0, dtype=np.float32),  # 连接建立时间(ms)
+    "latencies_dropped": 0,  # 延迟缓冲区写满后丢弃的样本数
     "timestamps": []  # 记录每个事件的时间戳
 }
 
-# 测试过程中的事件记录
-events = []
+# 所有客户端共用的WebSocket连接参数
+# 关闭permessage-deflate压缩，避免每帧额外的zlib开销；收发缓冲按小消息负载收紧
+# 心跳由测试在应用层自行发送，因此关闭库级ping及其超时计时器
+WS_CONNECT_KWARGS = {
+    "compression": None,
+    "max_size": 2 ** 16,
+    "max_queue": 32,
+    "read_limit": 2 ** 16,
+    "write_limit": 2 ** 16,
+    "ping_interval": None,
+    "ping_timeout": None,
+    "close_timeout": 5,
+}
+
+# 预编码的心跳消息模板，只需填入时间戳
+# 服务端使用receive_text接收，因此以文本帧而非二进制帧发送
+PING_TEMPLATE = '{"message_type":"ping","timestamp":%.6f}'
+
+# 接收路径的快速探测：只提取需要的字段，避免对每帧做完整的JSON解析
+# JSON字符串内的引号会被转义，因此这些模式不会误匹配消息正文
+PONG_RE = re.compile(r'"type"\s*:\s*"pong"')
+HISTORY_RE = re.compile(r'^\{\s*"type"\s*:\s*"history"')
+TS_RE = re.compile(r'"ts"\s*:\s*(\d+)')
+
+# 事件类型编码，事件以 (类型, 用户ID, 房间ID, 时间戳, 附加信息) 元组记录，避免每个事件分配一个字典
+EVENT_CONNECT = 0
+EVENT_CONNECT_ERROR = 1
+EVENT_DISCONNECT = 2
+EVENT_MESSAGE_SENT = 3
+EVENT_MESSAGE_ERROR = 4
+EVENT_MESSAGE_RECEIVED = 5
+EVENT_CONNECTION_CLOSED = 6
+EVENT_RECEIVE_ERROR = 7
+EVENT_TYPES = (
+    "connect",
+    "connect_error",
+    "disconnect",
+    "message_sent",
+    "message_error",
+    "message_received",
+    "connection_closed",
+    "receive_error",
+)
+EVENT_COLUMNS = ["type", "user_id", "room_id", "timestamp", "extra"]
+
+# 客户端本地缓冲的事件数，达到后整批提交到队列
+EVENT_FLUSH_SIZE = 64
+# 事件队列容量及单次排空的批大小（均以客户端提交的事件批为单位）
+EVENT_QUEUE_SIZE = 1024
+EVENT_BATCH_SIZE = 16
+
+# 测试过程中的事件队列及CSV写入器（在run_load_test中创建），由后台任务分批排空
+events_q = None
+events_writer = None
+events_logged = 0
+events_csv_paths = []  # 已写入的事件日志文件
+
+# 按事件类型分别保存的时间戳，供图表直接做直方图统计
+event_timestamps = [array.array('d') for _ in EVENT_TYPES]
+
+def submit_events(events: list):
+    """提交一批 (类型, user_id, room_id, 时间戳, extra) 事件，队列已满时整批丢弃并计数"""
+    try:
+        events_q.put_nowait(events)
+    except asyncio.QueueFull:
+        test_stats["events_dropped"] += len(events)
+
+def _collect_event_batch(batch: list) -> int:
+    """从队列中非阻塞地补满事件批次并写入CSV，返回取出的批次数"""
+    global events_logged
+    
+    while len(batch) < EVENT_BATCH_SIZE:
+        try:
+            batch.append(events_q.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    for events in batch:
+        for event in events:
+            event_timestamps[event[0]].append(event[3])
+        events_writer.writerows(
+            (EVENT_TYPES[event_type], user_id, room_id, ts, extra)
+            for event_type, user_id, room_id, ts, extra in events
+        )
+        events_logged += len(events)
+    return len(batch)
+
+async def event_drainer():
+    """后台事件排空任务，每次最多取出EVENT_BATCH_SIZE个事件"""
+    while True:
+        _collect_event_batch([await events_q.get()])
+
+def drain_events():
+    """测试结束后取出队列中剩余的全部事件"""
+    while _collect_event_batch([]):
+        pass
+
+class TokenBucket:
+    """令牌桶限速器，按固定速率均匀发放令牌，避免整秒突发唤醒"""
+    
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+    
+    async def acquire(self):
+        """获取一个令牌，令牌不足时等待"""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class TimerWheel:
+    """共享定时轮：由单个后台任务按固定刻度推进，客户端等待某个刻度而不是各自注册定时器"""
+    
+    def __init__(self, resolution: float = 0.1):
+        self.resolution = resolution
+        self.tick = 0
+        self._slots: Dict[int, asyncio.Event] = {}
+    
+    async def run(self):
+        """推进刻度并唤醒到期的等待者，落后时不等待直接追赶"""
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while True:
+            next_time += self.resolution
+            await asyncio.sleep(max(0.0, next_time - loop.time()))
+            self.tick += 1
+            event = self._slots.pop(self.tick, None)
+            if event is not None:
+                event.set()
+    
+    async def sleep(self, seconds: float):
+        """等待约seconds秒（按刻度取整，至少一个刻度）"""
+        slot = self.tick + max(1, round(seconds / self.resolution))
+        event = self._slots.get(slot)
+        if event is None:
+            event = self._slots[slot] = asyncio.Event()
+        await event.wait()
+
+class SampleBuffer:
+    """按预估样本数预分配的定长缓冲区，写满后丢弃新样本并计数"""
+    
+    def __init__(self, capacity: int, dtype):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+        self.dropped = 0
+    
+    def append(self, value):
+        if self.size < self.data.size:
+            self.data[self.size] = value
+            self.size += 1
+        else:
+            self.dropped += 1
+    
+    def values(self) -> np.ndarray:
+        """返回已写入部分的视图"""
+        return self.data[:self.size]
 
 class ChatClient:
     """WebSocket聊天客户端模拟器"""
     
-    def __init__(self, server_url: str, user_id: str, room_id: str):
+    def __init__(self, server_url: str, user_id: str, room_id: str, latencies: SampleBuffer = None):
         self.server_url = server_url.format(room_id=room_id)
         self.user_id = user_id
         self.room_id = room_id
         self.websocket = None
         self.is_connected = False
         self.message_count = 0
-        self.latencies = []
-        self.last_ping_time = 0
+        # 消息延迟(us)，通常为所有客户端共用的预分配缓冲区
+        self.latencies = latencies if latencies is not None else array.array('q')
+        self.last_ping_time = 0  # 单调时钟(ns)
+        
+        # 客户端本地统计，测试结束后统一汇总，避免热路径上修改共享字典
+        self.n_recv = 0
+        self.n_errors = 0
+        self.connect_time_ms = None  # 成功连接后记录
+        self.connect_failed = False
+        self._event_buf = []  # 本地事件缓冲，满EVENT_FLUSH_SIZE个后整批提交
+    
+    def record_event(self, event_type: int, extra=None):
+        """记录一个测试事件到本地缓冲"""
+        self._event_buf.append((event_type, self.user_id, self.room_id, time.time(), extra))
+        if len(self._event_buf) >= EVENT_FLUSH_SIZE:
+            self.flush_events()
+    
+    def flush_events(self):
+        """将本地缓冲的事件提交到事件队列"""
+        if self._event_buf:
+            submit_events(self._event_buf)
+            self._event_buf = []
         
     async def connect(self) -> bool:
         """建立WebSocket连接"""
-        connect_start = time.time()
+        connect_start = time.monotonic_ns()
         try:
             # 在URL中添加用户ID查询参数
             url_with_params = f"{self.server_url}?user_id={self.user_id}"
             
-            self.websocket = await websockets.connect(
-                url_with_params,
-                ping_interval=None,  # 禁用自动ping
-                close_timeout=5
-            )
+            self.websocket = await websockets.connect(url_with_params, **WS_CONNECT_KWARGS)
             self.is_connected = True
             
             # 记录连接时间
-            connect_time = (time.time() - connect_start) * 1000  # 转为毫秒
-            test_stats["connect_times"].append(connect_time)
-            
-            test_stats["connections_active"] += 1
-            events.append({
-                "type": "connect",
-                "user_id": self.user_id,
-                "room_id": self.room_id,
-                "timestamp": time.time(),
-                "connect_time": connect_time
-            })
+            self.connect_time_ms = (time.monotonic_ns() - connect_start) / 1e6  # 转为毫秒
+            self.record_event(EVENT_CONNECT, self.connect_time_ms)
             return True
             
         except Exception as e:
-            test_stats["connections_failed"] += 1
-            events.append({
-                "type": "connect_error",
-                "user_id": self.user_id,
-                "room_id": self.room_id,
-                "timestamp": time.time(),
-                "error": str(e)
-            })
+            self.connect_failed = True
+            self.record_event(EVENT_CONNECT_ERROR, str(e))
             return False
     
     async def disconnect(self):
@@ -108,14 +336,8 @@ class ChatClient:
             with suppress(Exception):
                 await self.websocket.close()
             self.is_connected = False
-            test_stats["connections_active"] -= 1
-            test_stats["connections_closed"] += 1
-            events.append({
-                "type": "disconnect",
-                "user_id": self.user_id,
-                "room_id": self.room_id,
-                "timestamp": time.time()
-            })
+            self.record_event(EVENT_DISCONNECT)
+            self.flush_events()
     
     async def send_message(self, content: str = None):
         """发送聊天消息"""
@@ -130,30 +352,20 @@ class ChatClient:
             message = {
                 "content": content,
                 "message_type": "text",
-                "timestamp": time.time()
+                "timestamp": time.time(),
+                # 单调时钟发送时间，服务端原样回传，用于计算延迟
+                "ts": time.monotonic_ns()
             }
             
-            await self.websocket.send(json.dumps(message))
+            await self.websocket.send(dumps(message))
             self.message_count += 1
-            test_stats["messages_sent"] += 1
             
-            events.append({
-                "type": "message_sent",
-                "user_id": self.user_id,
-                "room_id": self.room_id,
-                "timestamp": time.time()
-            })
+            self.record_event(EVENT_MESSAGE_SENT)
             return True
             
         except Exception as e:
-            test_stats["errors"] += 1
-            events.append({
-                "type": "message_error",
-                "user_id": self.user_id,
-                "room_id": self.room_id,
-                "timestamp": time.time(),
-                "error": str(e)
-            })
+            self.n_errors += 1
+            self.record_event(EVENT_MESSAGE_ERROR, str(e))
             return False
     
     async def send_ping(self):
@@ -162,17 +374,12 @@ class ChatClient:
             return False
             
         try:
-            message = {
-                "message_type": "ping",
-                "timestamp": time.time()
-            }
-            
-            await self.websocket.send(json.dumps(message))
-            self.last_ping_time = time.time()
+            await self.websocket.send(PING_TEMPLATE % time.time())
+            self.last_ping_time = time.monotonic_ns()
             return True
             
         except Exception as e:
-            test_stats["errors"] += 1
+            self.n_errors += 1
             return False
     
     async def receive_messages(self):
@@ -183,158 +390,242 @@ class ChatClient:
         try:
             async for message in self.websocket:
                 try:
-                    # 解析消息
-                    data = json.loads(message)
+                    if isinstance(message, bytes):
+                        message = message.decode("utf-8")
                     
                     # 处理ping-pong消息
-                    if data.get("type") == "pong":
+                    if PONG_RE.search(message):
                         continue
-                        
-                    # 计算消息延迟
-                    if "timestamp" in data and data["timestamp"] is not None:
-                        latency = (time.time() - float(data["timestamp"])) * 1000  # 转为毫秒
+                    
+                    # 计算消息延迟（仅针对携带单调时钟发送时间的消息）
+                    # 历史消息中嵌套的ts不代表本次传输延迟，需跳过
+                    match = None if HISTORY_RE.match(message) else TS_RE.search(message)
+                    if match:
+                        latency = (time.monotonic_ns() - int(match.group(1))) // 1000  # 转为微秒
                         self.latencies.append(latency)
-                        test_stats["latencies"].append(latency)
+                    else:
+                        # 未知格式的消息走完整解析，仅用于校验
+                        json.loads(message)
                     
-                    test_stats["messages_received"] += 1
-                    events.append({
-                        "type": "message_received",
-                        "user_id": self.user_id,
-                        "room_id": self.room_id,
-                        "timestamp": time.time()
-                    })
+                    self.n_recv += 1
+                    self.record_event(EVENT_MESSAGE_RECEIVED)
                     
-                except json.JSONDecodeError:
-                    test_stats["errors"] += 1
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    self.n_errors += 1
                     
         except websockets.exceptions.ConnectionClosed:
+            # 连接数统计在汇总阶段根据is_connected计算，这里只更新状态
             self.is_connected = False
-            test_stats["connections_active"] -= 1
-            test_stats["connections_closed"] += 1
-            events.append({
-                "type": "connection_closed",
-                "user_id": self.user_id,
-                "room_id": self.room_id,
-                "timestamp": time.time()
-            })
+            self.record_event(EVENT_CONNECTION_CLOSED)
             
         except Exception as e:
-            test_stats["errors"] += 1
+            self.n_errors += 1
             self.is_connected = False
-            events.append({
-                "type": "receive_error",
-                "user_id": self.user_id,
-                "room_id": self.room_id,
-                "timestamp": time.time(),
-                "error": str(e)
-            })
+            self.record_event(EVENT_RECEIVE_ERROR, str(e))
 
-async def client_session(config, user_id, room_id):
-    """完整的客户端会话流程"""
-    client = ChatClient(config["ws_server_url"], user_id, room_id)
+def build_session_schedule(config, user_id: str):
+    """预先生成客户端的发送决策和等待间隔，返回 (是否发送列表, 等待秒数列表)"""
+    # 最短等待0.5秒，步数上限由测试时长决定
+    n_steps = int(config["test_duration"] / 0.5) + 2
     
-    # 连接到服务器
-    connected = await client.connect()
-    if not connected:
-        return
-    
-    # 启动消息接收任务
-    receive_task = asyncio.create_task(client.receive_messages())
+    # 以全局种子和用户ID派生独立的随机流，保证结果可复现
+    rng = np.random.default_rng((config["random_seed"], zlib.crc32(user_id.encode())))
+    sends = rng.random(n_steps) < 0.2  # 20%概率发送消息
+    sleeps = rng.uniform(0.5, config["message_interval"], n_steps).astype(np.float32)
+    return sends.tolist(), sleeps.tolist()
+
+async def _send_loop(config, client: ChatClient, wheel: TimerWheel = None):
+    """按预生成的计划定期发送消息和心跳，结束时关闭连接以结束接收循环"""
+    sends, sleeps = build_session_schedule(config, client.user_id)
     
     try:
-        # 定期发送消息和心跳
-        end_time = time.time() + config["test_duration"]
-        while time.time() < end_time and client.is_connected:
+        end_time = time.monotonic_ns() + int(config["test_duration"] * 1e9)
+        ping_interval_ns = config["ping_interval"] * 1e9
+        for send, delay in zip(sends, sleeps):
+            now = time.monotonic_ns()
+            if now >= end_time or not client.is_connected:
+                break
+            
             # 发送测试消息
-            if random.random() < 0.2:  # 20%概率发送消息
+            if send:
                 await client.send_message()
             
             # 发送心跳
-            if time.time() - client.last_ping_time > config["ping_interval"]:
+            if now - client.last_ping_time > ping_interval_ns:
                 await client.send_ping()
                 
-            # 随机等待
-            await asyncio.sleep(random.uniform(0.5, config["message_interval"]))
+            # 随机等待，优先使用共享定时轮
+            if wheel is not None:
+                await wheel.sleep(delay)
+            else:
+                await asyncio.sleep(delay)
     
     finally:
-        # 关闭连接
+        # 关闭连接后receive_messages的迭代自然结束，无需取消接收任务
         await client.disconnect()
+
+async def client_session(config, client: ChatClient, connect_sem: asyncio.Semaphore = None,
+                         wheel: TimerWheel = None):
+    """完整的客户端会话流程"""
+    
+    try:
+        # 连接到服务器，信号量只限制握手阶段，不限制已建立的会话数
+        if connect_sem is not None:
+            async with connect_sem:
+                connected = await client.connect()
+        else:
+            connected = await client.connect()
+        if not connected:
+            return
         
-        # 取消接收任务
-        receive_task.cancel()
-        with suppress(asyncio.CancelledError):
-            await receive_task
+        # 接收与发送并发运行，外部取消时由任务组/gather统一取消两者
+        if TASKGROUP_AVAILABLE:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(client.receive_messages())
+                tg.create_task(_send_loop(config, client, wheel))
+        else:
+            await asyncio.gather(client.receive_messages(), _send_loop(config, client, wheel))
+    
+    finally:
+        # 提交连接失败、服务端关闭等断开后产生的剩余事件
+        client.flush_events()
+
+def aggregate_client_stats(clients: List[ChatClient], latencies: SampleBuffer):
+    """将各客户端的本地统计汇总到test_stats"""
+    connected = [client for client in clients if client.connect_time_ms is not None]
+    
+    test_stats["connections_failed"] = sum(client.connect_failed for client in clients)
+    test_stats["connections_active"] = sum(client.is_connected for client in connected)
+    test_stats["connections_closed"] = len(connected) - test_stats["connections_active"]
+    test_stats["messages_sent"] = sum(client.message_count for client in clients)
+    test_stats["messages_received"] = sum(client.n_recv for client in clients)
+    test_stats["errors"] = sum(client.n_errors for client in clients)
+    test_stats["connect_times"] = np.fromiter(
+        (client.connect_time_ms for client in connected), dtype=np.float32, count=len(connected)
+    )
+    test_stats["latencies"] = latencies.values()
+    test_stats["latencies_dropped"] = latencies.dropped
 
-async def check_server_health(config):
+async def check_server_health(config, session: aiohttp.ClientSession):
     """检查服务器健康状态"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{config['api_server_url']}/health") as response:
-                if response.status != 200:
-                    logger.error(f"Server health check failed with status {response.status}")
-                    return False
-                    
-                data = await response.json()
-                logger.info(f"Server health: {data['status']}")
-                logger.info(f"Active connections: {data['connections']['total_connections']}")
-                return data['status'] == 'ok'
+        async with session.get(f"{config['api_server_url']}/health") as response:
+            if response.status != 200:
+                logger.error(f"Server health check failed with status {response.status}")
+                return False
+                
+            data = await response.json()
+            logger.info(f"Server health: {data['status']}")
+            logger.info(f"Active connections: {data['connections']['total_connections']}")
+            return data['status'] == 'ok'
     except Exception as e:
         logger.error(f"Server health check failed: {str(e)}")
         return False
 
 async def run_load_test(config):
     """运行负载测试"""
-    # 设置随机数种子
-    random.seed(config["random_seed"])
+    global events_q, events_writer
+    
+    # 创建事件队列和CSV写入器，并启动后台排空任务
+    events_q = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+    events_file = open(config["events_csv"], "w", buffering=1 << 16, newline="")
+    events_csv_paths.append(config["events_csv"])
+    events_writer = csv.writer(events_file)
+    events_writer.writerow(EVENT_COLUMNS)
+    drainer_task = asyncio.create_task(event_drainer())
     
+    try:
+        # 整个测试共用一个HTTP会话，复用连接池和DNS缓存
+        connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await run_sessions(config, session)
+    finally:
+        # 停止排空任务并取出剩余事件
+        drainer_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await drainer_task
+        drain_events()
+        events_file.close()
+
+async def run_sessions(config, session: aiohttp.ClientSession):
+    """按指定速率建立客户端会话并等待其完成"""
     # 记录开始时间
     test_stats["start_time"] = time.time()
     logger.info(f"Starting load test with {config['total_connections']} connections across {config['rooms']} rooms")
     
     # 检查服务器健康状态
-    server_ok = await check_server_health(config)
+    server_ok = await check_server_health(config, session)
     if not server_ok:
         logger.error("Server health check failed, aborting test")
         return
     
-    # 创建测试会话任务
+    # 按令牌桶速率创建测试会话任务，信号量限制同时进行的连接握手数
     tasks = []
+    clients = []
+    
+    # 按预估样本数预分配延迟缓冲区：每个连接每秒约2条消息
+    latencies = SampleBuffer(config["total_connections"] * config["test_duration"] * 2, np.int64)
+    bucket = TokenBucket(config["connections_per_second"])
+    connect_sem = asyncio.Semaphore(config["connections_per_second"] * 4)
+    
+    # 所有会话共用一个定时轮，事件循环中只保留一个定时器
+    wheel = TimerWheel()
+    wheel_task = asyncio.create_task(wheel.run())
     pbar = tqdm(total=config["total_connections"], desc="Creating connections")
     
     for i in range(config["total_connections"]):
+        await bucket.acquire()
+        
         # 生成用户ID和分配聊天室
-        user_id = f"user_{i+1}"
-        room_id = f"room_{(i % config['rooms']) + 1}"
+        n = config["user_offset"] + i
+        user_id = f"user_{n+1}"
+        room_id = f"room_{(n % config['rooms']) + 1}"
         
         # 创建并启动客户端会话
-        task = asyncio.create_task(client_session(config, user_id, room_id))
+        client = ChatClient(config["ws_server_url"], user_id, room_id, latencies)
+        clients.append(client)
+        task = asyncio.create_task(client_session(config, client, connect_sem, wheel))
         tasks.append(task)
         test_stats["connections_sent"] += 1
-        
-        # 按照指定速率建立连接
-        if (i + 1) % config["connections_per_second"] == 0:
-            pbar.update(config["connections_per_second"])
-            await asyncio.sleep(1)
-        
-    # 更新剩余的进度条
-    remaining = config["total_connections"] % config["connections_per_second"]
-    if remaining > 0:
-        pbar.update(remaining)
+        pbar.update(1)
     pbar.close()
     
     # 等待所有任务完成
     total_duration = config["test_duration"] + 10  # 额外等待时间
     try:
-        _, pending = await asyncio.wait(tasks, timeout=total_duration)
-        if pending:
-            logger.warning(f"{len(pending)} tasks did not complete within the timeout period")
-            for task in pending:
-                task.cancel()
+        await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=total_duration)
+    except asyncio.TimeoutError:
+        # wait_for超时会取消gather，进而取消所有未完成的会话
+        pending = sum(1 for task in tasks if not task.done() or task.cancelled())
+        logger.warning(f"{pending} tasks did not complete within the timeout period")
     except Exception as e:
         logger.error(f"Error waiting for tasks to complete: {str(e)}")
+    finally:
+        wheel_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await wheel_task
+    
+    # 汇总各客户端的本地统计
+    aggregate_client_stats(clients, latencies)
     
     # 最后检查服务器状态
-    await check_server_health(config)
+    await check_server_health(config, session)
+
+def print_summary(title: str, a: np.ndarray):
+    """打印样本的最小/最大/平均/中位数"""
+    if a.size == 0:
+        return
+    
+    mid = a.size // 2
+    print(f"\n{title}:")
+    print(f"  最小: {a.min():.2f}")
+    print(f"  最大: {a.max():.2f}")
+    print(f"  平均: {a.mean(dtype=np.float64):.2f}")
+    print(f"  中位数: {np.partition(a, mid)[mid]:.2f}")
+
+def latencies_ms() -> np.ndarray:
+    """将微秒整数延迟转换为毫秒"""
+    return test_stats["latencies"] / 1000
 
 def generate_report(config):
     """生成测试报告"""
@@ -350,107 +641,214 @@ def generate_report(config):
     print(f"消息发送数: {test_stats['messages_sent']}")
     print(f"消息接收数: {test_stats['messages_received']}")
     print(f"错误数: {test_stats['errors']}")
+    if test_stats["events_dropped"]:
+        print(f"丢弃事件数: {test_stats['events_dropped']}")
+    if test_stats["latencies_dropped"]:
+        print(f"丢弃延迟样本数: {test_stats['latencies_dropped']}")
     
     # 性能指标
-    if test_stats["connect_times"]:
-        print(f"\n连接时间 (ms):")
-        print(f"  最小: {min(test_stats['connect_times']):.2f}")
-        print(f"  最大: {max(test_stats['connect_times']):.2f}")
-        print(f"  平均: {sum(test_stats['connect_times']) / len(test_stats['connect_times']):.2f}")
-        print(f"  中位数: {sorted(test_stats['connect_times'])[len(test_stats['connect_times']) // 2]:.2f}")
-        
-    if test_stats["latencies"]:
-        print(f"\n消息延迟 (ms):")
-        print(f"  最小: {min(test_stats['latencies']):.2f}")
-        print(f"  最大: {max(test_stats['latencies']):.2f}")
-        print(f"  平均: {sum(test_stats['latencies']) / len(test_stats['latencies']):.2f}")
-        print(f"  中位数: {sorted(test_stats['latencies'])[len(test_stats['latencies']) // 2]:.2f}")
+    print_summary("连接时间 (ms)", test_stats["connect_times"])
+    print_summary("消息延迟 (ms)", latencies_ms())
     
     # 吞吐量
     print(f"\n吞吐量:")
     print(f"  连接/秒: {test_stats['connections_sent'] / duration:.2f}")
     print(f"  消息/秒: {test_stats['messages_sent'] / duration:.2f}")
     
-    # 保存详细事件日志
-    events_df = pd.DataFrame(events)
-    if not events_df.empty:
-        events_df.to_csv("load_test_events.csv", index=False)
-        print("\n详细事件日志已保存到 load_test_events.csv")
+    # 详细事件日志已在测试过程中写入
+    if events_logged:
+        print(f"\n详细事件日志已保存到 {', '.join(events_csv_paths)}")
+    
+    # 大规模测试跳过图表，只导出原始数据
+    skip_charts = config["skip_charts"]
+    if skip_charts is None:
+        skip_charts = config["total_connections"] > CHART_AUTO_SKIP_CONNECTIONS
+    if skip_charts:
+        save_raw_data()
+        return
     
     # 生成图表
     try:
-        generate_charts()
+        generate_charts(duration)
     except Exception as e:
         logger.error(f"Error generating charts: {str(e)}")
 
-def generate_charts():
+def save_raw_data():
+    """导出原始样本数据，格式见RAW_DATA_PATH处的说明"""
+    def timestamps(event_type: int) -> np.ndarray:
+        return np.frombuffer(event_timestamps[event_type], dtype=np.float64)
+    
+    np.savez_compressed(
+        RAW_DATA_PATH,
+        connect_times=test_stats["connect_times"],
+        latencies=test_stats["latencies"],
+        ts_connect=timestamps(EVENT_CONNECT),
+        ts_disconnect=timestamps(EVENT_DISCONNECT),
+        ts_closed=timestamps(EVENT_CONNECTION_CLOSED),
+        ts_send=timestamps(EVENT_MESSAGE_SENT),
+        ts_recv=timestamps(EVENT_MESSAGE_RECEIVED),
+        start_time=np.float64(test_stats["start_time"])
+    )
+    print(f"已跳过图表生成，原始数据已保存到 {RAW_DATA_PATH}")
+
+def event_histogram(event_type: int, duration: float, bins: int = 30):
+    """按相对时间统计某类事件的直方图，返回 (计数, 分箱中心)"""
+    ts = np.frombuffer(event_timestamps[event_type], dtype=np.float64) - test_stats["start_time"]
+    counts, edges = np.histogram(ts, bins=bins, range=(0, duration))
+    return counts, (edges[:-1] + edges[1:]) / 2
+
+def new_chart(title: str, xlabel: str, ylabel: str):
+    """创建独立于pyplot状态机的图表，返回 (figure, axes)"""
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.grid(True)
+    return fig, ax
+
+def save_chart(fig: Figure, path: str):
+    """保存图表并立即释放其占用的资源"""
+    try:
+        fig.savefig(path)
+    finally:
+        fig.clf()
+
+def generate_charts(duration: float):
     """生成测试图表"""
-    if not events:
+    if not any(event_timestamps):
         return
+    
+    # 计算活跃连接数
+    connects, centers = event_histogram(EVENT_CONNECT, duration)
+    if connects.any():
+        disconnects, _ = event_histogram(EVENT_DISCONNECT, duration)
+        closed, _ = event_histogram(EVENT_CONNECTION_CLOSED, duration)
+        active = connects.cumsum() - disconnects.cumsum() - closed.cumsum()
         
-    # 转换事件为DataFrame
-    df = pd.DataFrame(events)
-    df["relative_time"] = df["timestamp"] - test_stats["start_time"]
-    
-    # 按时间段分组统计连接数
-    time_bins = pd.cut(df["relative_time"], bins=30)
-    connections_over_time = df[df["type"].isin(["connect", "disconnect", "connection_closed"])].groupby([time_bins, "type"]).size().unstack().fillna(0)
-    
-    if not connections_over_time.empty:
-        # 计算活跃连接数
-        if "connect" in connections_over_time.columns:
-            if "disconnect" not in connections_over_time.columns:
-                connections_over_time["disconnect"] = 0
-            if "connection_closed" not in connections_over_time.columns:
-                connections_over_time["connection_closed"] = 0
-                
-            connections_over_time["active"] = connections_over_time["connect"].cumsum() - \
-                                            connections_over_time["disconnect"].cumsum() - \
-                                            connections_over_time["connection_closed"].cumsum()
-            
-            # 绘制连接数图表
-            plt.figure(figsize=(12, 6))
-            connections_over_time["active"].plot(kind='line', color='blue', marker='o')
-            plt.title('Active Connections Over Time')
-            plt.xlabel('Time (s)')
-            plt.ylabel('Connections')
-            plt.grid(True)
-            plt.savefig("connections_chart.png")
-            plt.close()
-            print("连接数图表已保存到 connections_chart.png")
+        # 绘制连接数图表
+        fig, ax = new_chart('Active Connections Over Time', 'Time (s)', 'Connections')
+        ax.plot(centers, active, color='blue', marker='o')
+        save_chart(fig, "connections_chart.png")
+        print("连接数图表已保存到 connections_chart.png")
     
     # 绘制延迟分布图
-    if test_stats["latencies"]:
-        plt.figure(figsize=(12, 6))
-        plt.hist(test_stats["latencies"], bins=50, color='green', alpha=0.7)
-        plt.title('Message Latency Distribution')
-        plt.xlabel('Latency (ms)')
-        plt.ylabel('Frequency')
-        plt.grid(True)
-        plt.savefig("latency_chart.png")
-        plt.close()
+    if test_stats["latencies"].size:
+        fig, ax = new_chart('Message Latency Distribution', 'Latency (ms)', 'Frequency')
+        ax.hist(latencies_ms(), bins=50, color='green', alpha=0.7)
+        save_chart(fig, "latency_chart.png")
         print("延迟分布图已保存到 latency_chart.png")
-        
-    # 按时间段分组统计消息数
-    messages_over_time = df[df["type"].isin(["message_sent", "message_received"])].groupby([time_bins, "type"]).size().unstack().fillna(0)
     
-    if not messages_over_time.empty:
+    # 按时间段统计消息数
+    sent, centers = event_histogram(EVENT_MESSAGE_SENT, duration)
+    received, _ = event_histogram(EVENT_MESSAGE_RECEIVED, duration)
+    
+    if sent.any() or received.any():
         # 绘制消息吞吐量图表
-        plt.figure(figsize=(12, 6))
-        if "message_sent" in messages_over_time.columns:
-            messages_over_time["message_sent"].plot(kind='line', color='blue', marker='o', label='Sent')
-        if "message_received" in messages_over_time.columns:
-            messages_over_time["message_received"].plot(kind='line', color='green', marker='x', label='Received')
-        plt.title('Message Throughput Over Time')
-        plt.xlabel('Time (s)')
-        plt.ylabel('Messages')
-        plt.legend()
-        plt.grid(True)
-        plt.savefig("messages_chart.png")
-        plt.close()
+        fig, ax = new_chart('Message Throughput Over Time', 'Time (s)', 'Messages')
+        ax.plot(centers, sent, color='blue', marker='o', label='Sent')
+        ax.plot(centers, received, color='green', marker='x', label='Received')
+        ax.legend()
+        save_chart(fig, "messages_chart.png")
         print("消息吞吐量图表已保存到 messages_chart.png")
 
+def split_config(config, workers: int) -> List[Dict]:
+    """将测试配置按连接数和连接速率拆分给各工作进程"""
+    configs = []
+    offset = 0
+    for index in range(workers):
+        count = config["total_connections"] // workers + (index < config["total_connections"] % workers)
+        if count == 0:
+            continue
+        
+        worker_config = config.copy()
+        worker_config.update({
+            "total_connections": count,
+            "connections_per_second": max(1, config["connections_per_second"] // workers),
+            "user_offset": config["user_offset"] + offset,
+            "events_csv": f"{os.path.splitext(config['events_csv'])[0]}_{index}.csv",
+            "workers": 1
+        })
+        configs.append(worker_config)
+        offset += count
+    return configs
+
+def _worker_entry(config, result_q):
+    """工作进程入口：独立运行事件循环，并将统计结果以紧凑字节形式回传"""
+    install_event_loop_policy()
+    try:
+        asyncio.run(run_load_test(config))
+    except Exception as e:
+        logger.error(f"Worker failed: {str(e)}")
+    
+    result_q.put((
+        {key: test_stats[key] for key in SUMMED_STATS},
+        test_stats["latencies"].tobytes(),
+        test_stats["connect_times"].tobytes(),
+        [timestamps.tobytes() for timestamps in event_timestamps],
+        events_logged,
+        events_csv_paths
+    ))
+
+def run_workers(config):
+    """启动多个负载生成进程，并将各进程的结果合并到当前进程的统计中"""
+    global events_logged
+    
+    worker_configs = split_config(config, config["workers"])
+    ctx = multiprocessing.get_context("spawn")
+    result_q = ctx.Queue()
+    processes = [ctx.Process(target=_worker_entry, args=(worker_config, result_q)) for worker_config in worker_configs]
+    
+    test_stats["start_time"] = time.time()
+    for process in processes:
+        process.start()
+    
+    # 在join之前读取结果，避免大结果阻塞在管道中导致死锁
+    timeout = (config["test_duration"] + config["total_connections"] / config["connections_per_second"] + 60)
+    latency_parts = [test_stats["latencies"]]
+    connect_time_parts = [test_stats["connect_times"]]
+    for _ in processes:
+        try:
+            stats, latencies, connect_times, timestamps, logged, paths = result_q.get(timeout=timeout)
+        except queue.Empty:
+            logger.error("Timed out waiting for worker results")
+            break
+        
+        for key, value in stats.items():
+            test_stats[key] += value
+        latency_parts.append(np.frombuffer(latencies, dtype=np.int64))
+        connect_time_parts.append(np.frombuffer(connect_times, dtype=np.float32))
+        for merged, data in zip(event_timestamps, timestamps):
+            merged.frombytes(data)
+        events_logged += logged
+        events_csv_paths.extend(paths)
+    
+    test_stats["latencies"] = np.concatenate(latency_parts)
+    test_stats["connect_times"] = np.concatenate(connect_time_parts)
+    
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+def install_event_loop_policy():
+    """安装uvloop事件循环策略（如果可用）"""
+    if not UVLOOP_AVAILABLE or os.environ.get("DISABLE_UVLOOP") == "1":
+        logger.info("使用标准asyncio事件循环")
+        return False
+    
+    try:
+        uvloop.install()
+        logger.info("已启用uvloop高性能事件循环")
+        return True
+    except Exception as e:
+        logger.warning(f"无法设置uvloop事件循环策略: {e}")
+        return False
+
 def main():
+    # 使用uvloop替换默认事件循环
+    install_event_loop_policy()
+    
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='WebSocket Chat Server Load Test')
     parser.add_argument('--server', type=str, help='WebSocket server URL', default=DEFAULT_CONFIG["ws_server_url"])
@@ -460,6 +858,9 @@ def main():
     parser.add_argument('--rooms', type=int, help='Number of chat rooms', default=DEFAULT_CONFIG["rooms"])
     parser.add_argument('--duration', type=int, help='Test duration in seconds', default=DEFAULT_CONFIG["test_duration"])
     parser.add_argument('--message-interval', type=float, help='Message sending interval in seconds', default=DEFAULT_CONFIG["message_interval"])
+    parser.add_argument('--workers', type=int, help='Number of load generator processes', default=DEFAULT_CONFIG["workers"])
+    parser.add_argument('--skip-charts', action=argparse.BooleanOptionalAction, default=DEFAULT_CONFIG["skip_charts"],
+                        help=f'Skip charts and save raw arrays to {RAW_DATA_PATH} (default: on when connections > {CHART_AUTO_SKIP_CONNECTIONS})')
     args = parser.parse_args()
     
     # 更新配置
@@ -471,7 +872,9 @@ def main():
         "connections_per_second": args.rate,
         "rooms": args.rooms,
         "test_duration": args.duration,
-        "message_interval": args.message_interval
+        "message_interval": args.message_interval,
+        "workers": max(1, args.workers),
+        "skip_charts": args.skip_charts
     })
     
     # 显示测试配置
@@ -481,7 +884,10 @@ def main():
     print("========================================\n")
     
     # 运行测试
-    asyncio.run(run_load_test(config))
+    if config["workers"] > 1:
+        run_workers(config)
+    else:
+        asyncio.run(run_load_test(config))
     
     # 生成报告
     generate_report(config)
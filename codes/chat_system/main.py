@@ -3,8 +3,14 @@ import json
 import logging
 import os
 import time
-import signal
 import traceback
+import sys
+from collections import OrderedDict, deque
+from itertools import islice
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import urlsplit, unquote
+from dataclasses import dataclass, field, fields
 from typing import Dict, Optional, List, Any, Set
 
 # 配置日志
@@ -18,6 +24,7 @@ logger = logging.getLogger("ChatApp")
 REDIS_AVAILABLE = False
 UVLOOP_AVAILABLE = False
 AIOHTTP_AVAILABLE = False
+ORJSON_AVAILABLE = False
 PANDAS_AVAILABLE = False
 MATPLOTLIB_AVAILABLE = False
 
@@ -31,349 +38,31 @@ from fastapi.templating import Jinja2Templates
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel, Field
 
-# Redis支持 - 可选
+# Redis支持 - 可选，要求redis>=5（含hiredis解析器）以使用原生异步客户端
+REDIS_NATIVE_ASYNC = False
 try:
     import redis.asyncio as redis_async
+    from redis.asyncio import ConnectionPool
     REDIS_AVAILABLE = True
+    REDIS_NATIVE_ASYNC = True
     logger.info("使用redis.asyncio模块")
 except ImportError:
     try:
-        # 简单的Redis兼容层，保持代码一致性
-        import redis
-        
-        # 创建Redis兼容模块
-        class AsyncRedisPipelineWrapper:
-            """Redis Pipeline的异步包装器"""
-            
-            def __init__(self, pipeline, loop=None):
-                self._pipeline = pipeline
-                self._loop = loop or asyncio.get_event_loop()
-                
-            async def execute(self):
-                """执行管道中的所有命令"""
-                def _execute():
-                    return self._pipeline.execute()
-                return await self._run_in_executor(_execute)
-                
-            async def _run_in_executor(self, func):
-                return await self._loop.run_in_executor(None, func)
-                
-            # 支持管道操作
-            def __getattr__(self, name):
-                # 获取原始pipeline的方法
-                attr = getattr(self._pipeline, name)
-                
-                # 如果是方法，返回一个包装器，让管道可以链式调用
-                if callable(attr):
-                    def wrapper(*args, **kwargs):
-                        # 调用原始方法
-                        result = attr(*args, **kwargs)
-                        # 如果返回的是pipeline本身（链式调用），返回self
-                        if result == self._pipeline:
-                            return self
-                        return result
-                    return wrapper
-                return attr
-        
-        class AsyncPubSubWrapper:
-            """Redis PubSub对象的异步包装器"""
-            
-            def __init__(self, pubsub, loop=None):
-                self._pubsub = pubsub
-                self._loop = loop or asyncio.get_event_loop()
-            
-            async def subscribe(self, *channels):
-                """订阅频道"""
-                def _subscribe():
-                    return self._pubsub.subscribe(*channels)
-                return await self._run_in_executor(_subscribe)
-            
-            async def get_message(self, ignore_subscribe_messages=True, timeout=0):
-                """获取消息"""
-                def _get_message():
-                    return self._pubsub.get_message(
-                        ignore_subscribe_messages=ignore_subscribe_messages,
-                        timeout=timeout
-                    )
-                return await self._run_in_executor(_get_message)
-            
-            async def unsubscribe(self, *channels):
-                """取消订阅频道"""
-                def _unsubscribe():
-                    return self._pubsub.unsubscribe(*channels)
-                return await self._run_in_executor(_unsubscribe)
-            
-            async def close(self):
-                """关闭PubSub连接"""
-                def _close():
-                    return self._pubsub.close()
-                return await self._run_in_executor(_close)
-                
-            async def _run_in_executor(self, func):
-                return await self._loop.run_in_executor(None, func)
-        
-        class AsyncRedisWrapper:
-            """Redis异步API的兼容包装器，将同步Redis API包装成异步接口"""
-            
-            def __init__(self, url=None, host='localhost', port=6379, username=None, password=None, **kwargs):
-                """初始化Redis包装器
-                
-                参数:
-                    url: Redis连接URL
-                    host: Redis主机名
-                    port: Redis端口
-                    username: Redis用户名
-                    password: Redis密码
-                    **kwargs: 其他Redis连接参数
-                """
-                try:
-                    import redis as sync_redis_lib
-                    if url:
-                        self._redis = sync_redis_lib.from_url(url, **kwargs)
-                    else:
-                        self._redis = sync_redis_lib.Redis(
-                            host=host, 
-                            port=port,
-                            username=username,
-                            password=password,
-                            **kwargs
-                        )
-                    self._loop = None
-                except Exception as e:
-                    logger = logging.getLogger("AsyncRedisWrapper")
-                    logger.error(f"Redis客户端创建失败: {str(e)}")
-                    raise
-            
-            @classmethod
-            def from_url(cls, url, **kwargs):
-                """从URL创建Redis连接
-                
-                这是一个类方法，兼容redis.asyncio.Redis.from_url的接口
-                """
-                return cls(url, **kwargs)
-            
-            async def ping(self):
-                """测试Redis连接"""
-                def _ping():
-                    return self._redis.ping()
-                return await self._run_in_executor(_ping)
-            
-            async def get(self, key):
-                """获取键值"""
-                def _get():
-                    return self._redis.get(key)
-                return await self._run_in_executor(_get)
-            
-            async def set(self, key, value, **kwargs):
-                """设置键值"""
-                def _set():
-                    return self._redis.set(key, value, **kwargs)
-                return await self._run_in_executor(_set)
-            
-            async def delete(self, *keys):
-                """删除键"""
-                def _delete():
-                    return self._redis.delete(*keys)
-                return await self._run_in_executor(_delete)
-            
-            async def exists(self, *keys):
-                """检查键是否存在"""
-                def _exists():
-                    return self._redis.exists(*keys)
-                return await self._run_in_executor(_exists)
-            
-            async def expire(self, key, seconds):
-                """设置键过期时间"""
-                def _expire():
-                    return self._redis.expire(key, seconds)
-                return await self._run_in_executor(_expire)
-            
-            async def ttl(self, key):
-                """获取键剩余生存时间"""
-                def _ttl():
-                    return self._redis.ttl(key)
-                return await self._run_in_executor(_ttl)
-            
-            async def hset(self, name, key=None, value=None, mapping=None):
-                """设置哈希表中的字段值"""
-                def _hset():
-                    if mapping is not None:
-                        return self._redis.hset(name, mapping=mapping)
-                    else:
-                        return self._redis.hset(name, key, value)
-                return await self._run_in_executor(_hset)
-            
-            async def hget(self, name, key):
-                """获取哈希表字段值"""
-                def _hget():
-                    return self._redis.hget(name, key)
-                return await self._run_in_executor(_hget)
-            
-            async def hgetall(self, name):
-                """获取哈希表所有字段和值"""
-                def _hgetall():
-                    return self._redis.hgetall(name)
-                return await self._run_in_executor(_hgetall)
-            
-            async def publish(self, channel, message):
-                """发布消息到频道"""
-                def _publish():
-                    return self._redis.publish(channel, message)
-                return await self._run_in_executor(_publish)
-            
-            async def _run_in_executor(self, func):
-                """在执行器中运行同步函数"""
-                if self._loop is None:
-                    self._loop = asyncio.get_event_loop()
-                return await self._loop.run_in_executor(None, func)
-            
-            # 添加额外需要的方法
-            async def keys(self, pattern):
-                """查找所有符合给定模式的键"""
-                def _keys():
-                    return self._redis.keys(pattern)
-                return await self._run_in_executor(_keys)
-                
-            async def hincrby(self, name, key, amount=1):
-                """为哈希表指定字段的整数值加上增量"""
-                def _hincrby():
-                    return self._redis.hincrby(name, key, amount)
-                return await self._run_in_executor(_hincrby)
-                
-            async def sadd(self, name, *values):
-                """向集合添加一个或多个成员"""
-                def _sadd():
-                    return self._redis.sadd(name, *values)
-                return await self._run_in_executor(_sadd)
-                
-            async def smembers(self, name):
-                """返回集合中的所有成员"""
-                def _smembers():
-                    return self._redis.smembers(name)
-                return await self._run_in_executor(_smembers)
-                
-            async def srem(self, name, *values):
-                """移除集合中一个或多个成员"""
-                def _srem():
-                    return self._redis.srem(name, *values)
-                return await self._run_in_executor(_srem)
-                
-            async def hdel(self, name, *keys):
-                """删除一个或多个哈希表字段"""
-                def _hdel():
-                    return self._redis.hdel(name, *keys)
-                return await self._run_in_executor(_hdel)
-                
-            async def lpush(self, name, *values):
-                """将一个或多个值插入到列表头部"""
-                def _lpush():
-                    return self._redis.lpush(name, *values)
-                return await self._run_in_executor(_lpush)
-                
-            async def ltrim(self, name, start, end):
-                """对一个列表进行修剪(trim)"""
-                def _ltrim():
-                    return self._redis.ltrim(name, start, end)
-                return await self._run_in_executor(_ltrim)
-                
-            async def lrange(self, name, start, end):
-                """获取列表指定范围内的元素"""
-                def _lrange():
-                    return self._redis.lrange(name, start, end)
-                return await self._run_in_executor(_lrange)
-                
-            async def scard(self, name):
-                """获取集合的成员数"""
-                def _scard():
-                    return self._redis.scard(name)
-                return await self._run_in_executor(_scard)
-            
-            async def zrevrange(self, name, start, end, withscores=False):
-                """返回有序集合中指定区间内的成员，分数从高到低排序"""
-                def _zrevrange():
-                    return self._redis.zrevrange(name, start, end, withscores=withscores)
-                return await self._run_in_executor(_zrevrange)
-            
-            async def eval(self, script, keys=None, args=None):
-                """执行Lua脚本"""
-                def _eval():
-                    return self._redis.eval(script, len(keys) if keys else 0, *(keys or []) + (args or []))
-                return await self._run_in_executor(_eval)
-            
-            def pipeline(self):
-                """创建一个管道"""
-                # 创建一个简单的异步管道实现
-                pipe = self._redis.pipeline()
-                wrapper = AsyncRedisPipelineWrapper(pipe, self._loop)
-                return wrapper
-
-            async def close(self):
-                """关闭Redis连接"""
-                return self._redis.close()
-            
-            async def wait_closed(self):
-                """等待Redis连接关闭完成"""
-                # 同步客户端没有wait_closed方法，返回None即可
-                return None
-            
-            # 添加pubsub方法
-            def pubsub(self):
-                """获取PubSub对象"""
-                pubsub = self._redis.pubsub()
-                return AsyncPubSubWrapper(pubsub, self._loop)
-                
-            async def zadd(self, name, mapping):
-                """添加到有序集合"""
-                def _zadd():
-                    return self._redis.zadd(name, mapping)
-                return await self._run_in_executor(_zadd)
-            
-            async def zremrangebyrank(self, name, start, end):
-                """删除有序集合中指定排名范围内的所有成员"""
-                def _zremrangebyrank():
-                    return self._redis.zremrangebyrank(name, start, end)
-                return await self._run_in_executor(_zremrangebyrank)
-            
-            async def type(self, key):
-                """获取键的类型"""
-                def _type():
-                    return self._redis.type(key)
-                return await self._run_in_executor(_type)
+        # 旧版redis的最后兼容层：将同步API包装成异步接口，仅在此时才导入
+        from redis_compat import AsyncRedisWrapper, HIREDIS_AVAILABLE
         
         # 设置redis_async为我们的兼容包装器
         redis_async = AsyncRedisWrapper
         REDIS_AVAILABLE = True
-        logger.info("使用AsyncRedisWrapper兼容层")
+        if HIREDIS_AVAILABLE:
+            logger.info("使用AsyncRedisWrapper兼容层（hiredis解析器）")
+        else:
+            logger.warning("使用AsyncRedisWrapper兼容层，未安装hiredis，响应解析性能较差")
     except ImportError:
         redis_async = None
         REDIS_AVAILABLE = False
         logger.warning("Redis不可用")
 
-# 确保redis_async正确初始化
-if redis_async is None:
-    logger.error("redis_async初始化失败，尝试重新导入")
-    try:
-        import redis
-        # 创建一个简单的模拟类
-        class DummyRedisAsync:
-            @classmethod
-            def from_url(cls, *args, **kwargs):
-                logger.warning("使用无操作的Redis客户端")
-                return cls()
-                
-            async def ping(self):
-                return False
-                
-            async def close(self):
-                pass
-                
-            async def wait_closed(self):
-                pass
-                
-        redis_async = DummyRedisAsync
-    except ImportError:
-        logger.error("无法创建Redis兼容层")
-
 # uvloop支持 - 可选
 try:
     if os.environ.get("DISABLE_UVLOOP") != "1":
@@ -390,6 +79,21 @@ try:
 except ImportError:
     logger.warning("uvloop不可用，将使用标准事件循环")
 
+# orjson支持 - 可选，不可用时回退到标准json
+# WebSocket客户端（浏览器）按文本帧解析JSON，因此序列化结果仍解码为str发送
+try:
+    import orjson
+    
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+    
+    loads = orjson.loads
+    ORJSON_AVAILABLE = True
+except ImportError:
+    dumps = json.dumps
+    loads = json.loads
+    logger.warning("orjson不可用，将使用标准json序列化")
+
 # aiohttp支持 - 可选
 try:
     import aiohttp
@@ -421,7 +125,7 @@ logger.warning("数据分析和可视化功能已禁用，以避免numpy兼容
 
 from dotenv import load_dotenv
 
-from connection_manager import ConnectionManager
+from connection_manager import ConnectionManager, ROOM_HISTORY_SIZE
 from resource_scheduler import DynamicResourceScheduler
 from monitor import ChatSystemMonitor
 from distributed_lock import RedisDistributedLock
@@ -429,17 +133,6 @@ from distributed_lock import RedisDistributedLock
 # 加载环境变量
 load_dotenv()
 
-# 使用uvloop替换默认事件循环（如果可用）
-if UVLOOP_AVAILABLE and os.environ.get("DISABLE_UVLOOP") != "1":
-    try:
-        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
-        logger.info("已启用uvloop高性能事件循环")
-    except Exception as e:
-        logger.warning(f"无法设置uvloop事件循环策略: {e}")
-        logger.info("将使用标准事件循环")
-else:
-    logger.info("使用标准asyncio事件循环")
-
 # 创建FastAPI应用
 app = FastAPI(
     title="百万级WebSocket聊天系统",
@@ -469,43 +162,98 @@ templates = Jinja2Templates(directory=templates_path)
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost")
 NODE_ID = os.getenv("NODE_ID", f"node-{os.getpid()}")
 MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "100000"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
 API_KEY = os.getenv("API_KEY", "test123")  # 设置默认API密钥为test123
 
+# 所有房间ID的索引集合，列出房间时用SMEMBERS代替KEYS扫描整个键空间
+ROOM_INDEX_KEY = "room:index"
+
+# 聊天消息写入Redis的队列容量；后台写入任务每批最多合并的消息数，
+# 以及收到第一条消息后最多再等待多少毫秒凑批
+MESSAGE_WRITE_QUEUE_SIZE = 10000
+MESSAGE_WRITE_BATCH_SIZE = int(os.getenv("REDIS_BATCH_SIZE", "50"))
+MESSAGE_WRITE_BATCH_MS = float(os.getenv("REDIS_BATCH_MS", "5"))
+# 房间最后活动时间写回Redis的间隔（秒），期间同一房间的多次更新合并为一次
+LAST_ACTIVE_FLUSH_INTERVAL = 0.5
+# 同一房间内相同发送者、相同内容的消息在该时间窗口（秒）内只写入Redis一次，
+# 用于过滤客户端断线重试造成的重复写入；每个房间最多记录RECENT_WRITES_SIZE条
+DUPLICATE_WRITE_WINDOW = 1.0
+RECENT_WRITES_SIZE = 64
+
+# 单条WebSocket消息的最大长度，超出的消息在解析前直接丢弃
+MAX_MESSAGE_SIZE = 16384
+
+# 接收消息的超时时间（秒），超时只用于定期检查关闭标志，连接存活由WebSocket协议层ping负责
+RECEIVE_TIMEOUT = 60.0
+
 # 全局变量
 connection_manager = ConnectionManager()
 resource_scheduler = None
 system_monitor = None
 redis = None
+redis_pool = None  # 原生redis.asyncio的共享连接池
 shutdown_event = asyncio.Event()
+start_datetime = None  # 启动完成时间，健康检查据此计算运行时间，无需每次解析start_time
+message_write_queue = None  # 待写入Redis的 (room_id, message) 队列，由message_writer批量写入
+message_writer_task = None
+pending_last_active: Dict[str, float] = {}  # 尚未写回Redis的房间最后活动时间
+last_active_task = None
+recent_writes: "OrderedDict[str, OrderedDict[int, float]]" = OrderedDict()  # 房间最近写入消息的指纹及时间
 
 # API密钥验证（可选）
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
+# dataclass的slots参数需要Python 3.10+，低版本退回到普通实例字典
+DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(**DATACLASS_SLOTS)
+class SystemStatus:
+    """节点运行状态，字段固定，使用槽位属性代替字典键访问"""
+    start_time: Any  # 启动前为时间戳，启动后为ISO格式字符串
+    node_id: str
+    is_healthy: bool = True
+    degradation_level: int = 0
+    connections: int = 0
+    messages: int = 0
+    errors: int = 0
+    redis_connected: bool = False
+    process_cpu: float = 0.0
+    system_cpu: float = 0.0
+    process_memory_percent: float = 0.0
+    system_memory_percent: float = 0.0
+    task_queue_size: int = 0
+    version: str = "2.0.0"  # 系统版本
+    
+    def apply(self, new_status: Dict[str, Any]):
+        """用状态变更字典更新已知字段，忽略未知键"""
+        for key, value in new_status.items():
+            if key in SYSTEM_STATUS_FIELDS:
+                setattr(self, key, value)
+
+SYSTEM_STATUS_FIELDS = frozenset(f.name for f in fields(SystemStatus))
+
+@dataclass(**DATACLASS_SLOTS)
+class Room:
+    """单机模式下的内存聊天室"""
+    name: str
+    description: str = ""
+    users: Set[str] = field(default_factory=set)
+    created_at: float = field(default_factory=time.time)
+
 # 系统状态
-system_status = {
-    "start_time": time.time(),
-    "node_id": NODE_ID,
-    "is_healthy": True,
-    "degradation_level": 0,
-    "connections": 0,
-    "messages": 0,
-    "errors": 0,
-    "redis_connected": False, 
-    "process_cpu": 0.0,
-    "system_cpu": 0.0,
-    "process_memory_percent": 0.0,
-    "system_memory_percent": 0.0,
-    "task_queue_size": 0,
-    "version": "2.0.0"  # 添加系统版本
-}
+system_status = SystemStatus(start_time=time.time(), node_id=NODE_ID)
 
-# 单机模式下用于存储消息的内存字典
-in_memory_messages = {}
-in_memory_rooms = {
-    "general": {"name": "公共聊天室", "description": "所有用户的一般性讨论", "users": set()},
-    "tech": {"name": "技术讨论", "description": "讨论编程和技术话题", "users": set()},
-    "random": {"name": "随机话题", "description": "自由讨论各种话题", "users": set()}
-}
+# 单机模式下内存中最多保留的房间数，以及每个房间保留的消息数
+MAX_MEMORY_ROOMS = 10000
+MEMORY_HISTORY_SIZE = 100
+
+# 单机模式下用于存储消息的内存字典，按最近使用排序，每个房间的消息存放在定长deque中
+in_memory_messages: "OrderedDict[str, deque]" = OrderedDict()
+in_memory_rooms: "OrderedDict[str, Room]" = OrderedDict([
+    ("general", Room("公共聊天室", "所有用户的一般性讨论")),
+    ("tech", Room("技术讨论", "讨论编程和技术话题")),
+    ("random", Room("随机话题", "自由讨论各种话题"))
+])
 
 # 模型定义
 class Message(BaseModel):
@@ -538,37 +286,48 @@ async def get_current_user(request: Request):
         return None
     return user_id
 
+def _redis_on() -> bool:
+    """Redis已连接且客户端可用时返回True，否则走单机模式"""
+    return system_status.redis_connected and redis is not None
+
+async def redis_batch(client, ops: List[tuple]) -> List[Any]:
+    """批量执行只读/独立的Redis命令，ops为 (方法名, args, kwargs) 元组列表
+    
+    兼容层使用一次执行器提交完成全部命令，原生客户端使用非事务管道一次往返完成
+    """
+    if hasattr(client, "batch"):
+        return await client.batch(ops)
+    pipe = client.pipeline(transaction=False)
+    for name, args, kwargs in ops:
+        getattr(pipe, name)(*args, **kwargs)
+    return await pipe.execute()
+
+# 高频小消息的JSON模板，直接格式化字符串，省去构造字典和完整编码
+PONG_TEMPLATE = '{"type":"pong","timestamp":%r}'
+SYSTEM_MESSAGE_TEMPLATE = '{"type":"system","content":%s,"sender":"system","room":%s,"timestamp":%r}'
+HELP_CONTENT_JSON = dumps("可用命令:\n/help - 显示帮助\n/users - 显示在线用户\n/private <用户名> <消息> - 发送私聊消息")
+
+def system_message(content: str, room_id: str, timestamp: float) -> str:
+    """生成系统消息的JSON文本，只对可变的字符串字段做转义编码"""
+    return SYSTEM_MESSAGE_TEMPLATE % (dumps(content), dumps(room_id), timestamp)
+
+# 各降级级别（与SystemConfig一致，0-3）对应的通知内容，预先生成
+DEGRADATION_NOTICES = {
+    level: "系统正常运行" if level == 0 else f"系统当前处于性能降级状态 (级别 {level})"
+    for level in range(4)
+}
+
 # 状态变更回调函数
 async def status_change_handler(new_status: Dict[str, Any]):
     """处理系统状态变更事件"""
-    # 更新全局状态
-    for key, value in new_status.items():
-        if key in system_status:
-            system_status[key] = value
-    
-    # 确保特定CPU指标字段存在，避免KeyError
-    if "process_cpu" not in system_status and "process_cpu" in new_status:
-        system_status["process_cpu"] = new_status["process_cpu"]
-    
-    # 处理system_cpu字段
-    if "system_cpu" not in system_status and "system_cpu" in new_status:
-        system_status["system_cpu"] = new_status["system_cpu"]
-    
-    # 处理process_memory_percent字段
-    if "process_memory_percent" not in system_status and "process_memory_percent" in new_status:
-        system_status["process_memory_percent"] = new_status["process_memory_percent"]
-    
-    # 处理system_memory_percent字段
-    if "system_memory_percent" not in system_status and "system_memory_percent" in new_status:
-        system_status["system_memory_percent"] = new_status["system_memory_percent"]
+    # 更新全局状态，保留旧的降级级别用于判断是否变化
+    last_level = system_status.degradation_level
+    system_status.apply(new_status)
     
-    # 处理task_queue_size字段
-    if "task_queue_size" not in system_status and "task_queue_size" in new_status:
-        system_status["task_queue_size"] = new_status["task_queue_size"]
-    
-    # 如果系统降级级别改变，向所有客户端发送通知
-    if "degradation_level" in new_status:
-        message = "系统正常运行" if new_status["degradation_level"] == 0 else f"系统当前处于性能降级状态 (级别 {new_status['degradation_level']})"
+    # 只有系统降级级别实际改变时，才向所有客户端发送通知
+    level = new_status.get("degradation_level", last_level)
+    if level != last_level:
+        message = DEGRADATION_NOTICES.get(level) or f"系统当前处于性能降级状态 (级别 {level})"
         await connection_manager.broadcast_system_message(message)
     
     # 更新资源调度器的降级级别
@@ -578,7 +337,8 @@ async def status_change_handler(new_status: Dict[str, Any]):
 # 应用启动事件
 @app.on_event("startup")
 async def startup_event():
-    global resource_scheduler, system_monitor, redis, system_status
+    global resource_scheduler, system_monitor, redis, redis_pool, system_status, start_datetime
+    global message_write_queue, message_writer_task, last_active_task
     
     try:
         # 连接Redis（如果可用）
@@ -588,78 +348,55 @@ async def startup_event():
                 redis_url = os.getenv("REDIS_URL", "redis://localhost")
                 logger.info(f"配置的Redis URL: {redis_url}")
                 
-                # 解析Redis URL获取连接参数
-                host = "localhost"
-                port = 6379
-                username = None
-                password = None
+                # 解析Redis URL获取连接参数，兼容README中 redis://password@host 的只有密码格式
+                url = urlsplit(redis_url)
+                host = url.hostname or "localhost"
+                port = url.port or 6379
+                username = unquote(url.username) if url.username else None
+                password = unquote(url.password) if url.password else None
+                if username and password is None:
+                    username, password = None, username
+                db = int(url.path.lstrip("/") or 0)
                 
-                # 提取主机和端口
-                if "@" in redis_url:
-                    auth_part, conn_part = redis_url.replace("redis://", "").split("@")
-                    if ":" in conn_part:
-                        host, port = conn_part.split(":")
-                        port = int(port)
-                    else:
-                        host = conn_part
-                    
-                    # 提取密码（和可能的用户名）
-                    if auth_part.startswith(":"):  # 只有密码的格式 :password
-                        password = auth_part[1:]
-                    elif ":" in auth_part:         # 用户名:密码格式
-                        username, password = auth_part.split(":")
-                    else:                          # 只有密码，无冒号格式（兼容）
-                        password = auth_part
-                else:
-                    # 无认证的URL
-                    url_part = redis_url.replace("redis://", "")
-                    if ":" in url_part:
-                        host, port = url_part.split(":")
-                        port = int(port)
-                    else:
-                        host = url_part
-                
-                logger.info(f"Redis连接参数 - 主机: {host}, 端口: {port}, 用户名: {username}, 密码: {'已设置' if password else '未设置'}")
+                logger.info(f"Redis连接参数 - 主机: {host}, 端口: {port}, 数据库: {db}, 用户名: {username}, 密码: {'已设置' if password else '未设置'}")
                 
                 try:
-                    # 先用同步客户端测试连接
-                    import redis as sync_redis_lib
-                    
-                    sync_client = sync_redis_lib.Redis(
-                        host=host,
-                        port=port,
-                        username=username,
-                        password=password,
-                        socket_timeout=3.0,
-                        decode_responses=True
-                    )
-                    
-                    # 测试连接
-                    sync_ping = sync_client.ping()
-                    logger.info(f"Redis同步连接成功，ping结果: {sync_ping}")
-                    
-                    # 创建异步Redis客户端 - 使用直接参数方式
-                    # 使用导入重命名避免冲突
-                    redis = AsyncRedisWrapper(
-                        host=host, 
-                        port=port,
-                        username=username,
-                        password=password,
-                        decode_responses=True
-                    )
+                    # 创建异步Redis客户端 - 原生客户端使用应用级共享连接池，旧版redis使用兼容层
+                    if REDIS_NATIVE_ASYNC:
+                        redis_pool = ConnectionPool(
+                            host=host,
+                            port=port,
+                            username=username,
+                            password=password,
+                            db=db,
+                            decode_responses=True,
+                            max_connections=REDIS_MAX_CONNECTIONS
+                        )
+                        redis = redis_async.Redis(connection_pool=redis_pool)
+                    else:
+                        redis = AsyncRedisWrapper(
+                            host=host, 
+                            port=port,
+                            username=username,
+                            password=password,
+                            db=db,
+                            decode_responses=True
+                        )
                     
-                    # 测试异步连接
-                    ping_result = await redis.ping()
-                    logger.info(f"Redis异步连接成功，ping结果: {ping_result}")
+                    # 测试连接，连接失败或超时由下方异常处理退回单机模式
+                    ping_result = await asyncio.wait_for(redis.ping(), timeout=3.0)
+                    logger.info(f"Redis连接成功，ping结果: {ping_result}")
                     
-                    # 设置连接状态
-                    system_status["redis_connected"] = True
+                    # 设置连接状态，客户端作为应用级单例保存
+                    app.state.redis = redis
+                    system_status.redis_connected = True
                     logger.info("Redis连接成功，使用分布式模式")
                     
                     # 彻底清理Redis数据
                     try:
                         # 获取房间相关的所有模式
                         patterns = [
+                            "room:*:stream",
                             "room:*:messages",
                             "chat:room:*:messages",
                             "message:*"
@@ -668,17 +405,17 @@ async def startup_event():
                         logger.warning("开始清理Redis键，删除所有消息相关数据")
                         for pattern in patterns:
                             try:
-                                # 查找所有匹配键
-                                keys = await redis.keys(pattern)
-                                if keys:
-                                    logger.warning(f"找到 {len(keys)} 个匹配模式 {pattern} 的键，准备删除")
-                                    
-                                    # 分批删除，每批不超过100个
-                                    for i in range(0, len(keys), 100):
-                                        batch = keys[i:i+100]
-                                        if batch:
-                                            await redis.delete(*batch)
-                                            logger.info(f"已删除 {len(batch)} 个键")
+                                # 用SCAN增量查找，避免KEYS阻塞Redis；用UNLINK异步释放内存，每500个键执行一次管道
+                                pipe = redis.pipeline()
+                                n = 0
+                                async for key in redis.scan_iter(match=pattern, count=1000):
+                                    pipe.unlink(key)
+                                    n += 1
+                                    if n % 500 == 0:
+                                        await pipe.execute()
+                                await pipe.execute()
+                                if n:
+                                    logger.warning(f"已删除 {n} 个匹配模式 {pattern} 的键")
                             except Exception as e:
                                 logger.error(f"删除 {pattern} 模式的键时出错: {e}")
                         
@@ -686,6 +423,19 @@ async def startup_event():
                     except Exception as e:
                         logger.error(f"清理Redis数据失败: {e}")
                     
+                    # 用SCAN从已有的房间键补建房间索引，兼容索引引入之前创建的房间
+                    try:
+                        existing_room_ids = set()
+                        async for key in redis.scan_iter(match="room:*", count=500):
+                            room_id = key.split(":")[1]
+                            if key != ROOM_INDEX_KEY and room_id:
+                                existing_room_ids.add(room_id)
+                        if existing_room_ids:
+                            await redis.sadd(ROOM_INDEX_KEY, *existing_room_ids)
+                            logger.info(f"已补建房间索引，共 {len(existing_room_ids)} 个房间")
+                    except Exception as e:
+                        logger.error(f"补建房间索引失败: {e}")
+                    
                     # 重新创建基本房间
                     default_rooms = [
                         {"id": "general", "name": "公共聊天室", "description": "所有用户的一般性讨论"},
@@ -693,35 +443,55 @@ async def startup_event():
                         {"id": "random", "name": "随机话题", "description": "自由讨论各种话题"}
                     ]
                     
-                    for room in default_rooms:
-                        try:
+                    # 房间创建和节点上线消息合并到一个管道中，一次往返完成
+                    try:
+                        pipe = redis.pipeline()
+                        for room in default_rooms:
                             # 创建房间信息
                             room_data = {
                                 "name": room["name"],
                                 "description": room["description"],
-                                "created_at": str(time.time())
+                                "created_at": time.time()
                             }
-                            await redis.hset(f"room:{room['id']}", mapping=room_data)
-                        except Exception as e:
-                            logger.error(f"创建房间 {room['id']} 失败: {e}")
+                            pipe.hset(f"room:{room['id']}", mapping=room_data)
+                        pipe.sadd(ROOM_INDEX_KEY, *(room["id"] for room in default_rooms))
+                        
+                        # 向Redis发布节点上线消息
+                        pipe.publish("system:node_online", dumps({
+                            "node_id": NODE_ID,
+                            "timestamp": time.time(),
+                            "max_connections": MAX_CONNECTIONS
+                        }))
+                        await pipe.execute()
+                    except Exception as e:
+                        logger.error(f"创建默认房间或发布节点上线消息失败: {e}")
                 except Exception as e:
-                    logger.error(f"Redis连接失败: {str(e)}")
-                    system_status["redis_connected"] = False
+                    logger.error(f"Redis连接失败: {str(e) or type(e).__name__}")
+                    system_status.redis_connected = False
                     redis = None
+                    if redis_pool is not None:
+                        await redis_pool.disconnect()
+                        redis_pool = None
                     logger.warning("将使用单机模式运行")
             except Exception as e:
                 logger.warning(f"Redis连接过程出错: {e}")
-                system_status["redis_connected"] = False
+                system_status.redis_connected = False
                 redis = None
                 logger.warning("将使用单机模式运行")
         else:
             logger.warning("Redis依赖不可用，将使用单机模式运行")
-            system_status["redis_connected"] = False
+            system_status.redis_connected = False
             redis = None
         
         # 初始化连接管理器
         await connection_manager.initialize(redis)
         
+        # 分布式模式下启动消息批量写入任务
+        if _redis_on():
+            message_write_queue = asyncio.Queue(maxsize=MESSAGE_WRITE_QUEUE_SIZE)
+            message_writer_task = asyncio.create_task(message_writer())
+            last_active_task = asyncio.create_task(last_active_flusher())
+        
         # 初始化资源调度器
         resource_scheduler = DynamicResourceScheduler()
         await resource_scheduler.initialize_scheduler()
@@ -747,50 +517,20 @@ async def startup_event():
         await system_monitor.start_monitoring()
         
         # 记录启动时间
-        from datetime import datetime
-        system_status["start_time"] = datetime.now().isoformat()
-        
-        # 改进的信号处理逻辑
-        async def handle_exit_signal(sig_name):
-            logger.warning(f"收到 {sig_name} 信号，正在关闭应用...")
-            
-            # 标记关闭事件
-            shutdown_event.set()
-            
-            # 关闭所有连接和服务
-            await shutdown_app()
-            
-            # 强制退出，确保进程不会悬挂
-            import os, signal
-            os.kill(os.getpid(), signal.SIGKILL)
+        start_datetime = datetime.now()
+        system_status.start_time = start_datetime.isoformat()
         
-        # 设置信号处理
-        for sig in (signal.SIGTERM, signal.SIGINT):
-            loop = asyncio.get_running_loop()
-            loop.add_signal_handler(
-                sig, 
-                lambda s=sig: asyncio.create_task(handle_exit_signal(s.name))
-            )
+        # 不覆盖Uvicorn/Gunicorn自身的SIGTERM/SIGINT处理：服务器会停止接收新连接，
+        # 执行下方注册的shutdown事件（shutdown_app），然后自然退出，不再强制SIGKILL
         
-        # 向Redis发布节点上线消息
-        if system_status["redis_connected"]:
-            try:
-                await redis.publish("system:node_online", json.dumps({
-                    "node_id": NODE_ID,
-                    "timestamp": time.time(),
-                    "max_connections": MAX_CONNECTIONS
-                }))
-            except Exception as e:
-                logger.warning(f"发布节点上线消息失败: {e}")
-        
-        logger.info(f"聊天系统启动成功，节点ID: {NODE_ID}, 模式: {'分布式' if system_status['redis_connected'] else '单机'}")
+        logger.info(f"聊天系统启动成功，节点ID: {NODE_ID}, 模式: {'分布式' if system_status.redis_connected else '单机'}")
         
     except Exception as e:
         logger.error(f"系统启动错误: {e}")
         logger.error(traceback.format_exc())
         
         # 设置错误状态
-        system_status["is_healthy"] = False
+        system_status.is_healthy = False
         
         # 尝试以降级模式继续运行
         logger.info("尝试以降级模式启动...")
@@ -823,19 +563,22 @@ async def shutdown_app():
     # 第一步：向所有客户端发送关闭通知
     logger.info("正在向所有客户端发送关闭通知...")
     try:
-        close_msg = json.dumps({
+        close_msg = dumps({
             "type": "system",
             "content": "系统正在关闭，连接将被断开",
             "sender": "system",
             "timestamp": time.time()
         })
         
+        # 所有房间的关闭通知并发投递，避免房间较多时超出关闭超时
         rooms = list(connection_manager.room_user_map.keys())
-        for room_id in rooms:
-            try:
-                await connection_manager.broadcast_to_room(room_id, close_msg)
-            except Exception as e:
-                logger.error(f"向房间 {room_id} 发送关闭消息失败: {e}")
+        results = await asyncio.gather(
+            *(connection_manager.broadcast_to_room(room_id, close_msg) for room_id in rooms),
+            return_exceptions=True
+        )
+        for room_id, result in zip(rooms, results):
+            if isinstance(result, Exception):
+                logger.error(f"向房间 {room_id} 发送关闭消息失败: {result}")
     except Exception as e:
         logger.error(f"发送关闭通知时出错: {e}")
     
@@ -867,19 +610,37 @@ async def shutdown_app():
             logger.error(f"停止资源调度器时出错: {e}")
     
     # 第五步：关闭Redis连接
-    if system_status["redis_connected"] and redis:
+    if _redis_on():
+        # 先把队列中尚未写入的消息写完，最多等待2秒
+        if message_writer_task:
+            try:
+                await asyncio.wait_for(message_write_queue.join(), timeout=2.0)
+            except asyncio.TimeoutError:
+                logger.warning(f"消息写入队列未能按时清空，剩余 {message_write_queue.qsize()} 条消息")
+            message_writer_task.cancel()
+        if last_active_task:
+            last_active_task.cancel()
+            await flush_last_active()
+        
         try:
-            # 发布节点下线消息
-            await redis.publish("system:node_offline", json.dumps({
+            # 发布节点下线消息，Redis已不可用时最多等待1秒，不阻塞关闭流程
+            pipe = redis.pipeline(transaction=False)
+            pipe.publish("system:node_offline", dumps({
                 "node_id": NODE_ID,
                 "timestamp": time.time()
             }))
-            
-            # 关闭Redis连接
-            await redis.close()
-            logger.info("Redis连接已关闭")
+            await asyncio.wait_for(pipe.execute(), timeout=1.0)
         except Exception as e:
-            logger.error(f"关闭Redis连接时出错: {e}")
+            logger.error(f"发布节点下线消息时出错: {str(e) or type(e).__name__}")
+        finally:
+            try:
+                # 关闭Redis连接，外部传入的连接池需要单独断开
+                await asyncio.wait_for(redis.close(), timeout=1.0)
+                if redis_pool is not None:
+                    await asyncio.wait_for(redis_pool.disconnect(), timeout=1.0)
+                logger.info("Redis连接已关闭")
+            except Exception as e:
+                logger.error(f"关闭Redis连接时出错: {str(e) or type(e).__name__}")
     
     logger.info("应用程序已完全关闭")
 
@@ -889,7 +650,7 @@ async def health_check():
     """系统健康状态检查接口"""
     # 检查系统组件
     components_status = {
-        "redis": system_status["redis_connected"],
+        "redis": system_status.redis_connected,
         "connection_manager": connection_manager.healthy if hasattr(connection_manager, 'healthy') else True,
         "resource_scheduler": not shutdown_event.is_set(),
         "system_monitor": system_monitor is not None
@@ -897,36 +658,27 @@ async def health_check():
     
     # 计算服务器正常运行时间
     uptime = "N/A"
-    if "start_time" in system_status and system_status["start_time"]:
-        try:
-            from datetime import datetime
-            if isinstance(system_status["start_time"], str):
-                start_time = datetime.fromisoformat(system_status["start_time"])
-            else:
-                start_time = datetime.fromtimestamp(system_status["start_time"])
-            uptime_seconds = (datetime.now() - start_time).total_seconds()
-            uptime = f"{int(uptime_seconds // 86400)}d {int((uptime_seconds % 86400) // 3600)}h {int((uptime_seconds % 3600) // 60)}m"
-        except Exception as e:
-            logger.error(f"计算运行时间出错: {e}")
-            uptime = "N/A"
+    if start_datetime is not None:
+        uptime_seconds = (datetime.now() - start_datetime).total_seconds()
+        uptime = f"{int(uptime_seconds // 86400)}d {int((uptime_seconds % 86400) // 3600)}h {int((uptime_seconds % 3600) // 60)}m"
     
     # 获取连接统计信息
     connection_stats = await connection_manager.get_connection_stats()
     
     # 构建响应
     response = {
-        "status": "ok" if system_status["is_healthy"] else "degraded",
-        "degradation_level": system_status["degradation_level"],
+        "status": "ok" if system_status.is_healthy else "degraded",
+        "degradation_level": system_status.degradation_level,
         "components": components_status,
-        "version": system_status.get("version", "2.0.0"),  # 使用get方法避免KeyError
+        "version": system_status.version,
         "node_id": NODE_ID,
-        "start_time": system_status.get("start_time"),
+        "start_time": system_status.start_time,
         "uptime": uptime,
         "connections": connection_stats
     }
     
     # 根据系统状态设置响应状态码
-    status_code = 200 if system_status["is_healthy"] else 503
+    status_code = 200 if system_status.is_healthy else 503
     
     return JSONResponse(content=response, status_code=status_code)
 
@@ -942,13 +694,12 @@ async def get_home(request: Request):
     
     # 获取房间列表
     rooms = []
-    if system_status["redis_connected"]:
+    if system_status.redis_connected:
         try:
-            room_keys = await redis.keys("room:*")
-            for room_key in room_keys:
-                room_data = await redis.hgetall(room_key)
+            room_ids = list(await redis.smembers(ROOM_INDEX_KEY))
+            all_room_data = await redis_batch(redis, [("hgetall", (f"room:{room_id}",), {}) for room_id in room_ids])
+            for room_id, room_data in zip(room_ids, all_room_data):
                 if room_data:
-                    room_id = room_key.split(":", 1)[1]
                     rooms.append({
                         "id": room_id,
                         "name": room_data.get("name", room_id),
@@ -960,8 +711,8 @@ async def get_home(request: Request):
     else:
         # 单机模式下从内存获取房间
         rooms = [
-            {"id": room_id, "name": room_data["name"], "description": room_data["description"], "users": len(room_data["users"])}
-            for room_id, room_data in in_memory_rooms.items()
+            {"id": room_id, "name": room.name, "description": room.description, "users": len(room.users)}
+            for room_id, room in in_memory_rooms.items()
         ]
     
     # 获取连接统计信息
@@ -974,9 +725,9 @@ async def get_home(request: Request):
             "request": request, 
             "rooms": rooms,
             "system_status": {
-                "mode": "分布式" if system_status["redis_connected"] else "单机",
-                "is_healthy": system_status["is_healthy"],
-                "degradation_level": system_status["degradation_level"],
+                "mode": "分布式" if system_status.redis_connected else "单机",
+                "is_healthy": system_status.is_healthy,
+                "degradation_level": system_status.degradation_level,
                 "connections": total_connections
             }
         }
@@ -995,18 +746,18 @@ async def get_chat_room(
     
     # 检查房间是否存在
     if redis:
-        room_exists = await redis.exists(f"room:{room_id}:info")
-        if not room_exists:
-            # 创建默认房间信息
-            await redis.hset(
-                f"room:{room_id}:info",
-                mapping={
-                    "name": f"聊天室 {room_id}",
-                    "description": "自动创建的聊天室",
-                    "created_at": time.time(),
-                    "created_by": user
-                }
-            )
+        # 房间不存在时创建默认房间信息并加入房间索引，HSETNX只写入缺失的字段，
+        # 省去先EXISTS再写入的一次往返
+        pipe = redis.pipeline(transaction=False)
+        for key, value in (
+            ("name", f"聊天室 {room_id}"),
+            ("description", "自动创建的聊天室"),
+            ("created_at", time.time()),
+            ("created_by", user)
+        ):
+            pipe.hsetnx(f"room:{room_id}:info", key, value)
+        pipe.sadd(ROOM_INDEX_KEY, room_id)
+        await pipe.execute()
     
     return templates.TemplateResponse(
         "chat.html", 
@@ -1018,16 +769,43 @@ async def get_chat_room(
         }
     )
 
+# 聊天命令处理函数
+async def _cmd_help(room_id: str, user_id: str, msg: Dict[str, Any]):
+    """发送帮助信息"""
+    help_msg = SYSTEM_MESSAGE_TEMPLATE % (HELP_CONTENT_JSON, dumps(room_id), msg["timestamp"])
+    await connection_manager.send_personal_message(user_id, help_msg)
+
+async def _cmd_users(room_id: str, user_id: str, msg: Dict[str, Any]):
+    """发送房间在线用户列表"""
+    online_users = []
+    if _redis_on():
+        try:
+            online_users = await redis.smembers(f"room:{room_id}:users")
+        except Exception as e:
+            logger.error(f"获取在线用户列表失败: {e}")
+    else:
+        # 单机模式
+        if room_id in in_memory_rooms:
+            online_users = list(in_memory_rooms[room_id].users)
+    
+    users_msg = system_message(
+        f"在线用户 ({len(online_users)}):\n" + "\n".join(online_users), room_id, msg["timestamp"]
+    )
+    await connection_manager.send_personal_message(user_id, users_msg)
+
+# 命令名到处理函数的分发表，新增命令只需在此注册
+COMMANDS = {
+    "/help": _cmd_help,
+    "/users": _cmd_users,
+}
+
 # WebSocket连接端点
 @app.websocket("/ws/{room_id}/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
-    # 检查连接数是否达到上限
-    connection_stats = await connection_manager.get_connection_stats()
-    active_connections = connection_stats["total_connections"]
-    
-    if active_connections >= MAX_CONNECTIONS:
+    # 检查连接数是否达到上限，直接读取连接管理器维护的计数
+    if connection_manager.current_connections >= MAX_CONNECTIONS:
         # 根据降级策略决定是否拒绝连接
-        if system_status["degradation_level"] >= 2:
+        if system_status.degradation_level >= 2:
             await websocket.accept()  # 必须先接受连接才能发送关闭消息
             await websocket.close(code=1013, reason="服务器连接数已达上限，请稍后重试")
             return
@@ -1042,91 +820,65 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
         return
     
     # 更新房间用户计数
-    if system_status["redis_connected"] and redis:
+    if _redis_on():
         try:
-            # 将用户添加到房间集合
-            await redis.sadd(f"room:{room_id}:users", user_id)
-            # 更新房间统计信息
-            await redis.hincrby(f"room:{room_id}", "user_count", 1)
+            # 将用户添加到房间集合并更新房间统计信息，一次往返完成
+            pipe = redis.pipeline(transaction=False)
+            pipe.sadd(f"room:{room_id}:users", user_id)
+            pipe.sadd(ROOM_INDEX_KEY, room_id)
+            pipe.hincrby(f"room:{room_id}", "user_count", 1)
+            await pipe.execute()
         except Exception as e:
             logger.error(f"更新房间用户数据时出错: {e}")
     else:
         # 单机模式
         if room_id in in_memory_rooms:
-            if "users" not in in_memory_rooms[room_id]:
-                in_memory_rooms[room_id]["users"] = set()
-            in_memory_rooms[room_id]["users"].add(user_id)
+            in_memory_rooms[room_id].users.add(user_id)
+            in_memory_rooms.move_to_end(room_id)
         else:
-            in_memory_rooms[room_id] = {"users": {user_id}, "name": room_id, "created_at": time.time()}
-    
-    # 准备欢迎消息
-    welcome_msg = {
-        "type": "system",
-        "content": f"欢迎 {user_id} 加入聊天室",
-        "sender": "system",
-        "room": room_id,
-        "timestamp": time.time()
-    }
+            in_memory_rooms[room_id] = Room(room_id, users={user_id})
+            if len(in_memory_rooms) > MAX_MEMORY_ROOMS:
+                # 淘汰最久未使用的空房间及其消息
+                for old_room_id, old_room in in_memory_rooms.items():
+                    if not old_room.users:
+                        del in_memory_rooms[old_room_id]
+                        in_memory_messages.pop(old_room_id, None)
+                        break
     
     # 发送欢迎消息
-    welcome_msg_json = json.dumps(welcome_msg)
-    await connection_manager.broadcast_to_room(room_id, welcome_msg_json)
+    welcome_msg_json = system_message(f"欢迎 {user_id} 加入聊天室", room_id, time.time())
+    connection_manager.broadcast_nowait(room_id, welcome_msg_json)
     
     # 发送历史消息
     try:
         history_messages = []
-        if system_status["redis_connected"] and redis:
+        if _redis_on():
             try:
                 # 从Redis获取最近的消息，使用超时
                 async def get_messages():
                     try:
-                        # 从有序集合获取消息ID，按时间戳倒序
-                        message_ids = await redis.zrevrange(f"room:{room_id}:messages", 0, 49)
-                        if not message_ids:
-                            return []
-                            
-                        messages = []
+                        # 从房间消息流中一次取出最新的50条消息，按写入顺序倒序
+                        entries = await redis.xrevrange(_room_keys(room_id)[0], count=50)
                         
-                        # 获取每条消息的详细信息
-                        for msg_id in message_ids:
+                        messages = []
+                        for msg_id, msg_data in reversed(entries):
+                            # 转换时间戳为浮点数
                             try:
-                                # 处理可能的字节类型
-                                if isinstance(msg_id, bytes):
-                                    msg_id_str = msg_id.decode('utf-8')
-                                else:
-                                    msg_id_str = str(msg_id)
-                                    
-                                msg_data = await redis.hgetall(f"message:{msg_id_str}")
-                                if msg_data:
-                                    # 转换所有字段为字符串，处理可能的bytes类型
-                                    processed_data = {}
-                                    for k, v in msg_data.items():
-                                        if isinstance(k, bytes):
-                                            k = k.decode('utf-8')
-                                        if isinstance(v, bytes):
-                                            v = v.decode('utf-8')
-                                        processed_data[k] = v
-                                    
-                                    # 转换时间戳为浮点数
-                                    try:
-                                        timestamp = float(processed_data.get("timestamp", 0))
-                                    except (ValueError, TypeError):
-                                        timestamp = 0
-                                    
-                                    messages.append({
-                                        "id": msg_id_str,
-                                        "room": room_id,
-                                        "content": processed_data.get("content", ""),
-                                        "sender": processed_data.get("sender", "system"),
-                                        "timestamp": timestamp,
-                                        "type": processed_data.get("type", "text")
-                                    })
-                            except Exception as e:
-                                logger.error(f"获取消息 {msg_id} 失败: {e}")
-                                continue
+                                timestamp = float(msg_data.get("timestamp", 0))
+                            except (ValueError, TypeError):
+                                timestamp = 0
+                            
+                            messages.append({
+                                "id": msg_id,
+                                "room": room_id,
+                                "content": msg_data.get("content", ""),
+                                "sender": msg_data.get("sender", "system"),
+                                "timestamp": timestamp,
+                                "type": msg_data.get("type", "text")
+                            })
                         
-                        # 按时间戳排序
-                        return sorted(messages, key=lambda x: x.get("timestamp", 0))
+                        # 消息流按写入顺序排列，已是时间顺序
+                        return messages
                     except Exception as e:
                         logger.error(f"获取历史消息失败: {e}")
                         return []
@@ -1142,8 +894,9 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
                 logger.error(f"从Redis获取历史消息时出错: {e}")
         else:
             # 单机模式 - 从内存获取消息
+            # 消息按写入顺序保存，已是时间顺序，无需排序
             if room_id in in_memory_messages:
-                history_messages = sorted(in_memory_messages[room_id], key=lambda x: x.get("timestamp", 0))[-50:]
+                history_messages = await get_room_history_from_memory(room_id)
         
         # 发送历史消息
         if history_messages:
@@ -1151,7 +904,8 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
                 "type": "history",
                 "messages": history_messages
             }
-            await connection_manager.send_personal_message(user_id, json.dumps(history_msg))
+            # 直接编码：orjson和json编码期间都持有GIL，放到线程池也不会释放事件循环
+            await connection_manager.send_personal_message(user_id, dumps(history_msg))
     except Exception as e:
         logger.error(f"发送历史消息时出错: {e}")
     
@@ -1164,61 +918,58 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
             # 接收来自客户端的消息
             try:
                 # 设置接收超时，防止长时间阻塞
-                message_data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
+                message_data = await asyncio.wait_for(websocket.receive_text(), timeout=RECEIVE_TIMEOUT)
                 
-                if not message_data.strip():
+                # 只做长度检查，不再strip复制整条消息；空白消息由下方解析失败分支处理
+                if not message_data or len(message_data) > MAX_MESSAGE_SIZE:
                     continue
                     
                 try:
                     # 处理消息频率限制（防止洪水攻击）
-                    if system_status["degradation_level"] >= 1:
+                    if system_status.degradation_level >= 1:
                         await asyncio.sleep(0.5)  # 降级模式下，添加延迟
                     
                     # 解析消息
-                    msg = json.loads(message_data)
+                    msg = loads(message_data)
                     
                     # 确保消息包含必要字段
                     if "content" not in msg or "type" not in msg:
                         continue
                     
+                    # 每条消息只读取一次时钟，秒级时间戳和毫秒级消息ID都由它派生
+                    ns = time.time_ns()
+                    ts = ns / 1e9
+                    
                     # 处理不同类型的消息
                     msg["sender"] = user_id
                     msg["room"] = room_id  # 强制设置为当前房间ID，确保消息隔离
-                    msg["timestamp"] = time.time()
-                    
-                    # 保存消息到存储
-                    msg_id = f"{room_id}:{int(time.time() * 1000)}:{user_id}"
+                    msg["timestamp"] = ts
                     
                     # 确认消息类型
                     if msg["type"] == "ping":
-                        # 心跳消息，直接返回pong
-                        pong_msg = {
-                            "type": "pong",
-                            "timestamp": time.time()
-                        }
-                        await websocket.send_json(pong_msg)
+                        # 心跳消息，pong与其他出站消息一样经连接的出站队列发送，保证同一连接只有一个发送方
+                        await connection_manager.send_to_connection(websocket, user_id, room_id, PONG_TEMPLATE % ts)
                         
                     elif msg["type"] in ["text", "chat"]:
                         # 普通聊天消息
                         # 保存到Redis或内存
-                        if system_status["redis_connected"] and redis:
-                            try:
-                                # 异步保存消息
-                                asyncio.create_task(
-                                    store_message_to_redis(room_id, msg)
-                                )
-                            except Exception as e:
-                                logger.error(f"保存消息到Redis失败: {e}")
+                        if _redis_on():
+                            # 客户端重试造成的重复消息已经写入过Redis，不再入队
+                            if not _is_duplicate_write(room_id, msg, ts):
+                                try:
+                                    # 放入写入队列，由后台任务批量写入Redis
+                                    message_write_queue.put_nowait((room_id, msg))
+                                except asyncio.QueueFull:
+                                    logger.warning(f"消息写入队列已满，房间 {room_id} 的消息未保存")
                         else:
-                            # 单机模式 - 保存到内存
-                            asyncio.create_task(
-                                store_message_in_memory(room_id, msg)
-                            )
+                            # 单机模式 - 保存到内存，不涉及IO，直接完成
+                            await store_message_in_memory(room_id, msg)
                         
                         # 广播到当前房间
                         msg["room"] = room_id  # 再次确认房间ID正确
-                        logger.debug(f"广播消息到房间 {room_id}: {msg}")
-                        await connection_manager.broadcast_to_room(room_id, json.dumps(msg))
+                        # 热路径上的调试日志使用%格式，日志级别未开启DEBUG时不格式化消息
+                        logger.debug("广播消息到房间 %s: %s", room_id, msg)
+                        await connection_manager.broadcast_to_room(room_id, dumps(msg))
                     
                     elif msg["type"] == "private" and "to" in msg:
                         # 私聊消息
@@ -1226,48 +977,19 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
                         
                         # 修改消息类型
                         msg["type"] = "private"
-                        msg["id"] = msg_id
+                        # 消息ID只有私聊消息需要，用到时才生成
+                        msg["id"] = f"{room_id}:{ns // 1_000_000}:{user_id}"
                         
-                        # 发送给接收者
-                        await connection_manager.send_personal_message(recipient, json.dumps(msg))
-                        # 同时发送给发送者
-                        await connection_manager.send_personal_message(user_id, json.dumps(msg))
+                        # 只编码一次，发送给接收者并同时发送给发送者
+                        payload = dumps(msg)
+                        await connection_manager.send_personal_message(recipient, payload)
+                        await connection_manager.send_personal_message(user_id, payload)
                     
                     elif msg["type"] == "command":
-                        # 处理命令消息
-                        if msg["content"].startswith("/help"):
-                            # 发送帮助信息
-                            help_msg = {
-                                "type": "system",
-                                "content": "可用命令:\n/help - 显示帮助\n/users - 显示在线用户\n/private <用户名> <消息> - 发送私聊消息",
-                                "sender": "system",
-                                "room": room_id,
-                                "timestamp": time.time()
-                            }
-                            await connection_manager.send_personal_message(help_msg, user_id)
-                        
-                        elif msg["content"].startswith("/users"):
-                            # 获取房间在线用户
-                            online_users = []
-                            if system_status["redis_connected"] and redis:
-                                try:
-                                    online_users = await redis.smembers(f"room:{room_id}:users")
-                                except Exception as e:
-                                    logger.error(f"获取在线用户列表失败: {e}")
-                            else:
-                                # 单机模式
-                                if room_id in in_memory_rooms:
-                                    online_users = list(in_memory_rooms[room_id]["users"])
-                            
-                            # 发送用户列表
-                            users_msg = {
-                                "type": "system",
-                                "content": f"在线用户 ({len(online_users)}):\n" + "\n".join(online_users),
-                                "sender": "system",
-                                "room": room_id,
-                                "timestamp": time.time()
-                            }
-                            await connection_manager.send_personal_message(users_msg, user_id)
+                        # 处理命令消息，按第一个词查表分发
+                        handler = COMMANDS.get(msg["content"].split(" ", 1)[0])
+                        if handler:
+                            await handler(room_id, user_id, msg)
                 
                 except json.JSONDecodeError:
                     logger.warning(f"无效的消息格式: {message_data[:100]}")
@@ -1276,16 +998,8 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
                     logger.error(traceback.format_exc())
             
             except asyncio.TimeoutError:
-                # 接收超时，发送ping来保持连接
-                try:
-                    ping_msg = {
-                        "type": "ping",
-                        "timestamp": time.time()
-                    }
-                    await websocket.send_json(ping_msg)
-                except Exception:
-                    # 如果发送失败，说明连接可能已关闭
-                    break
+                # 接收超时，回到循环开头检查关闭标志；保活由Uvicorn的协议层ping完成，无需发送应用层ping
+                continue
             except Exception as e:
                 # WebSocket可能已关闭
                 logger.debug(f"接收消息失败，可能连接已关闭: {e}")
@@ -1303,30 +1017,25 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
             await connection_manager.disconnect(websocket_obj, user_id, room_id)
             
             # 更新房间用户计数
-            if system_status["redis_connected"] and redis:
+            if _redis_on():
                 try:
-                    # 从房间集合中移除用户
-                    await redis.srem(f"room:{room_id}:users", user_id)
-                    # 更新房间统计信息
-                    await redis.hincrby(f"room:{room_id}", "user_count", -1)
+                    # 从房间集合中移除用户并更新房间统计信息，一次往返完成
+                    pipe = redis.pipeline(transaction=False)
+                    pipe.srem(f"room:{room_id}:users", user_id)
+                    pipe.hincrby(f"room:{room_id}", "user_count", -1)
+                    await pipe.execute()
                 except Exception as e:
                     logger.error(f"更新房间用户数据时出错: {e}")
             else:
                 # 单机模式
-                if room_id in in_memory_rooms and "users" in in_memory_rooms[room_id] and user_id in in_memory_rooms[room_id]["users"]:
-                    in_memory_rooms[room_id]["users"].remove(user_id)
+                if room_id in in_memory_rooms and user_id in in_memory_rooms[room_id].users:
+                    in_memory_rooms[room_id].users.remove(user_id)
             
             # 广播用户离开消息
-            leave_msg = {
-                "type": "system",
-                "content": f"{user_id} 离开了聊天室",
-                "sender": "system",
-                "room": room_id,
-                "timestamp": time.time()
-            }
+            leave_msg = system_message(f"{user_id} 离开了聊天室", room_id, time.time())
             try:
                 # 只向当前聊天室广播
-                await connection_manager.broadcast_to_room(room_id, json.dumps(leave_msg))
+                connection_manager.broadcast_nowait(room_id, leave_msg)
             except Exception as e:
                 logger.error(f"广播用户离开消息出错: {e}")
         except Exception as e:
@@ -1336,7 +1045,7 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
 @app.post("/api/messages", dependencies=[Depends(verify_api_key)])
 async def send_message(message: Message, background_tasks: BackgroundTasks):
     """通过API发送消息"""
-    if not system_status["is_healthy"] and message.priority > 3:
+    if not system_status.is_healthy and message.priority > 3:
         return JSONResponse(
             status_code=503,
             content={"error": "系统处于降级状态，暂时只接受高优先级消息"}
@@ -1373,22 +1082,21 @@ async def get_rooms():
     try:
         rooms = []
         
-        if system_status["redis_connected"] and redis:
-            # 从Redis获取房间信息
-            room_keys = await redis.keys("room:*")
-            room_ids = []
-            
-            for key in room_keys:
-                parts = key.split(":")
-                if len(parts) >= 2 and parts[0] == "room":
-                    room_id = parts[1]
-                    if room_id not in room_ids and not room_id.endswith(":users") and not room_id.endswith(":messages"):
-                        room_ids.append(room_id)
+        if _redis_on():
+            # 从房间索引获取房间ID，代价与房间数成正比而不是整个键空间
+            room_ids = list(await redis.smembers(ROOM_INDEX_KEY))
             
+            # 所有房间的信息和在线人数一次批量获取
+            ops = []
             for room_id in room_ids:
+                ops.append(("hgetall", (f"room:{room_id}",), {}))
+                ops.append(("scard", (f"room:{room_id}:users",), {}))
+            results = await redis_batch(redis, ops)
+            
+            for i, room_id in enumerate(room_ids):
                 try:
-                    room_data = await redis.hgetall(f"room:{room_id}")
-                    user_count = await redis.scard(f"room:{room_id}:users")
+                    room_data = results[2 * i]
+                    user_count = results[2 * i + 1]
                     
                     rooms.append({
                         "id": room_id,
@@ -1401,23 +1109,24 @@ async def get_rooms():
                     logger.error(f"获取房间 {room_id} 信息时出错: {e}")
         else:
             # 单机模式，使用内存中的房间
-            for room_id, data in in_memory_rooms.items():
+            for room_id, room in in_memory_rooms.items():
                 rooms.append({
                     "id": room_id,
-                    "name": data.get("name", room_id),
-                    "description": data.get("description", ""),
-                    "users": len(data.get("users", set())),
-                    "created_at": data.get("created_at", time.time() - 3600)  # 假设一小时前创建
+                    "name": room.name,
+                    "description": room.description,
+                    "users": len(room.users),
+                    "created_at": room.created_at
                 })
         
         # 如果没有房间，添加默认房间
         if not rooms:
             for room_id in ["general", "tech", "random"]:
+                room = in_memory_rooms.get(room_id)
                 rooms.append({
                     "id": room_id,
-                    "name": in_memory_rooms.get(room_id, {}).get("name", f"聊天室 {room_id}"),
-                    "description": in_memory_rooms.get(room_id, {}).get("description", "默认聊天室"),
-                    "users": len(in_memory_rooms.get(room_id, {}).get("users", set())),
+                    "name": room.name if room else f"聊天室 {room_id}",
+                    "description": room.description if room else "默认聊天室",
+                    "users": len(room.users) if room else 0,
                     "created_at": time.time() - 3600
                 })
         
@@ -1438,7 +1147,7 @@ async def get_room_users(room_id: str):
     try:
         users = []
         
-        if system_status["redis_connected"] and redis:
+        if _redis_on():
             # 从Redis获取用户列表
             try:
                 user_ids = await redis.smembers(f"room:{room_id}:users")
@@ -1447,8 +1156,8 @@ async def get_room_users(room_id: str):
                 logger.error(f"从Redis获取房间 {room_id} 用户列表失败: {e}")
         else:
             # 单机模式，从内存获取
-            if room_id in in_memory_rooms and "users" in in_memory_rooms[room_id]:
-                users = list(in_memory_rooms[room_id]["users"])
+            if room_id in in_memory_rooms:
+                users = list(in_memory_rooms[room_id].users)
         
         return {"users": users, "count": len(users)}
     except Exception as e:
@@ -1471,8 +1180,9 @@ async def create_room(room: RoomCreate):
                 content={"error": f"房间 {room.room_id} 已存在"}
             )
         
-        # 创建房间信息
-        await redis.hset(
+        # 创建房间信息并加入房间索引
+        pipe = redis.pipeline(transaction=False)
+        pipe.hset(
             f"room:{room.room_id}:info",
             mapping={
                 "name": room.name,
@@ -1481,6 +1191,8 @@ async def create_room(room: RoomCreate):
                 "created_at": time.time()
             }
         )
+        pipe.sadd(ROOM_INDEX_KEY, room.room_id)
+        await pipe.execute()
         
         return {
             "success": True,
@@ -1539,9 +1251,9 @@ async def configure_system(config: SystemConfig):
             logger.info(f"最大连接数已更新为: {MAX_CONNECTIONS}")
         
         # 手动设置降级级别
-        if system_status["degradation_level"] != config.degradation_level:
-            old_level = system_status["degradation_level"]
-            system_status["degradation_level"] = config.degradation_level
+        if system_status.degradation_level != config.degradation_level:
+            old_level = system_status.degradation_level
+            system_status.degradation_level = config.degradation_level
             
             # 更新连接管理器状态
             connection_manager.is_degraded = config.degradation_level > 0
@@ -1560,7 +1272,7 @@ async def configure_system(config: SystemConfig):
         return {
             "success": True,
             "max_connections": MAX_CONNECTIONS,
-            "degradation_level": system_status["degradation_level"]
+            "degradation_level": system_status.degradation_level
         }
     except Exception as e:
         logger.error(f"配置系统错误: {e}")
@@ -1645,51 +1357,113 @@ async def redis_benchmark():
     }
 
 # 存储消息函数
-async def store_message_to_redis(room_id: str, message: Dict):
-    """将消息保存到Redis中"""
-    try:
-        # 确保消息有时间戳
-        if "timestamp" not in message:
-            message["timestamp"] = time.time()
-            
-        # 确保所有消息字段都是字符串类型
-        timestamp = message.get("timestamp", time.time())
-        if not isinstance(timestamp, (int, float)):
-            try:
-                timestamp = float(timestamp)
-            except (ValueError, TypeError):
-                timestamp = time.time()
-        
-        # 生成消息ID
-        msg_id = f"{room_id}:{int(timestamp * 1000)}:{message.get('sender', 'system')}"
-            
-        # 使用Redis hash存储消息
-        mapping = {
+@lru_cache(maxsize=MAX_MEMORY_ROOMS)
+def _room_keys(room_id: str) -> tuple:
+    """房间的消息流键和房间信息哈希键，按房间缓存，避免每条消息重新格式化"""
+    return f"room:{room_id}:stream", f"room:{room_id}"
+
+def _is_duplicate_write(room_id: str, message: Dict, timestamp: float) -> bool:
+    """检查消息是否在DUPLICATE_WRITE_WINDOW内已写入过，未写入过则记录其指纹"""
+    recent = recent_writes.get(room_id)
+    if recent is None:
+        recent = recent_writes[room_id] = OrderedDict()
+        if len(recent_writes) > MAX_MEMORY_ROOMS:
+            recent_writes.popitem(last=False)
+    else:
+        recent_writes.move_to_end(room_id)
+    
+    h = hash((message.get("sender"), message.get("content"))) & 0xFFFFFFFF
+    if recent.get(h, 0) > timestamp - DUPLICATE_WRITE_WINDOW:
+        return True
+    
+    recent[h] = timestamp
+    recent.move_to_end(h)
+    if len(recent) > RECENT_WRITES_SIZE:
+        recent.popitem(last=False)
+    return False
+
+def _queue_store_message(pipe, room_id: str, message: Dict) -> float:
+    """将一条消息的存储命令加入管道，返回消息时间戳"""
+    # 确保消息有数值时间戳，WebSocket消息已带有数值时间戳，只读取一次
+    timestamp = message.get("timestamp")
+    if not isinstance(timestamp, (int, float)):
+        try:
+            timestamp = float(timestamp)
+        except (ValueError, TypeError):
+            timestamp = time.time()
+        message["timestamp"] = timestamp
+    
+    # 追加到房间消息流，消息ID由Redis生成；MAXLEN ~ 近似裁剪，只保留约ROOM_HISTORY_SIZE条
+    pipe.xadd(
+        _room_keys(room_id)[0],
+        {
             "content": str(message.get("content", "")),
             "sender": str(message.get("sender", "system")),
             "type": str(message.get("type", "text")),
-            "timestamp": str(timestamp)
-        }
-        
-        # 存储消息内容
-        await redis.hset(f"message:{msg_id}", mapping=mapping)
-        
-        # 使用有序集合保存消息ID，以时间戳为分数
-        await redis.zadd(
-            f"room:{room_id}:messages", 
-            {msg_id: timestamp}
-        )
-        
-        # 限制消息数量，保留最新的100条
-        await redis.zremrangebyrank(f"room:{room_id}:messages", 0, -101)
-        
-        # 更新房间的最后活动时间
-        await redis.hset(f"room:{room_id}", "last_active", str(timestamp))
+            "timestamp": timestamp  # 数值直接交给客户端编码，无需先转为字符串
+        },
+        maxlen=ROOM_HISTORY_SIZE,
+        approximate=True
+    )
+    
+    # 最后活动时间由last_active_flusher定期合并写回
+    pending_last_active[room_id] = timestamp
+    return timestamp
+
+def _drain_write_queue(batch: List[tuple]):
+    """不等待地从写入队列取出消息，直到队列为空或凑满一批"""
+    while len(batch) < MESSAGE_WRITE_BATCH_SIZE and not message_write_queue.empty():
+        batch.append(message_write_queue.get_nowait())
+
+async def _collect_write_batch() -> List[tuple]:
+    """等待第一条待写入消息；未凑满一批时再等待MESSAGE_WRITE_BATCH_MS毫秒收集后续消息"""
+    batch = [await message_write_queue.get()]
+    _drain_write_queue(batch)
+    if len(batch) < MESSAGE_WRITE_BATCH_SIZE and MESSAGE_WRITE_BATCH_MS > 0:
+        await asyncio.sleep(MESSAGE_WRITE_BATCH_MS / 1000)
+        _drain_write_queue(batch)
+    return batch
+
+async def message_writer():
+    """后台写入任务：从队列批量取出消息，合并到一个管道中写入Redis
+    
+    管道对象在任务内复用，execute后会自动清空命令并归还连接，每批只从连接池取一次连接
+    """
+    pipe = redis.pipeline(transaction=False)
+    while True:
+        batch = await _collect_write_batch()
         
-        return True
+        try:
+            for room_id, message in batch:
+                _queue_store_message(pipe, room_id, message)
+            await pipe.execute()
+        except Exception as e:
+            logger.error("批量保存 %d 条消息到Redis失败: %s", len(batch), e)
+            # 命令加入管道时出错不会经过execute的清理，换一个新管道，避免残留命令混入下一批
+            pipe = redis.pipeline(transaction=False)
+        finally:
+            for _ in batch:
+                message_write_queue.task_done()
+
+async def flush_last_active():
+    """将累积的房间最后活动时间用一个管道写回Redis"""
+    if not pending_last_active:
+        return
+    pending = dict(pending_last_active)
+    pending_last_active.clear()
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for room_id, last_active in pending.items():
+            pipe.hset(_room_keys(room_id)[1], b"last_active", last_active)
+        await pipe.execute()
     except Exception as e:
-        logger.error(f"保存消息到Redis失败: {e}")
-        return False
+        logger.error(f"更新 {len(pending)} 个房间的最后活动时间失败: {e}")
+
+async def last_active_flusher():
+    """后台任务：每LAST_ACTIVE_FLUSH_INTERVAL秒写回一次房间最后活动时间"""
+    while True:
+        await asyncio.sleep(LAST_ACTIVE_FLUSH_INTERVAL)
+        await flush_last_active()
 
 async def store_message_in_memory(room_id: str, message: Dict):
     """将消息保存到内存中（Redis不可用时的备用方案）"""
@@ -1697,24 +1471,42 @@ async def store_message_in_memory(room_id: str, message: Dict):
     if "timestamp" not in message:
         message["timestamp"] = time.time()
         
-    # 添加到内存存储中
-    if room_id not in in_memory_messages:
-        in_memory_messages[room_id] = []
-        
-    # 添加消息
-    in_memory_messages[room_id].append(message)
+    # 添加到内存存储中，deque写满后自动丢弃最旧的消息
+    messages = in_memory_messages.get(room_id)
+    if messages is None:
+        messages = in_memory_messages[room_id] = deque(maxlen=MEMORY_HISTORY_SIZE)
+        if len(in_memory_messages) > MAX_MEMORY_ROOMS:
+            in_memory_messages.popitem(last=False)
+    else:
+        in_memory_messages.move_to_end(room_id)
     
-    # 限制长度
-    if len(in_memory_messages[room_id]) > 100:
-        in_memory_messages[room_id] = in_memory_messages[room_id][-100:]
+    # 添加消息
+    messages.append(message)
 
 # 单机模式下获取历史消息
 async def get_room_history_from_memory(room_id: str, limit: int = 50) -> List[Dict]:
     if room_id not in in_memory_messages:
         return []
     
-    # 返回最近的消息
-    return in_memory_messages[room_id][-limit:]
+    # 返回最近的消息，只复制需要的部分
+    messages = in_memory_messages[room_id]
+    return list(islice(messages, max(0, len(messages) - limit), None))
+
+def _worker_count() -> int:
+    """Uvicorn工作进程数：WORKERS优先，其次是Uvicorn/Gunicorn约定的WEB_CONCURRENCY，默认为1
+
+    WebSocket聊天消息和私信只广播给本进程持有的连接，多进程时同一房间中连接到不同进程的用户
+    互相收不到消息，因此只在显式配置时启动多个进程
+    """
+    configured = os.getenv("WORKERS") or os.getenv("WEB_CONCURRENCY")
+    if not configured:
+        return 1
+    workers = int(configured)
+    if workers > 1:
+        logger.warning(f"启动了 {workers} 个工作进程，WebSocket消息只广播给同一进程内的连接")
+        if not os.getenv("REDIS_URL"):
+            logger.warning("单机模式下各工作进程之间也不共享房间和消息")
+    return workers
 
 # 主函数
 def main():
@@ -1722,13 +1514,25 @@ def main():
     # 设置环境变量表示Uvicorn运行
     os.environ["UVICORN_RUNNING"] = "1"
     
-    # 使用Uvicorn启动应用
+    # 使用Uvicorn启动应用，优先使用uvloop和httptools（C扩展实现）
+    # DISABLE_UVLOOP=1仅用于调试，会退回到标准asyncio事件循环
+    import importlib.util
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        log_level="info",
-        loop="uvloop"
+        # Uvicorn默认每个请求输出一行访问日志，高并发下只保留警告及以上级别
+        log_level=os.getenv("UVICORN_LOG_LEVEL", "warning"),
+        loop="uvloop" if UVLOOP_AVAILABLE else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        ws="websockets",
+        # 广播时同一帧要发给房间内所有连接，permessage-deflate会对每个连接各压缩一次，
+        # 聊天消息通常只有几百字节，压缩收益远小于CPU开销，因此关闭
+        ws_per_message_deflate=False,
+        # 由websockets库发送协议层ping帧检测死连接
+        ws_ping_interval=20.0,
+        ws_ping_timeout=20.0,
+        workers=_worker_count()
     )
 
 if __name__ == "__main__":
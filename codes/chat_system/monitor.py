@@ -5,8 +5,9 @@ import os
 import psutil
 import json
 import socket
-import random
-import traceback
+import sys
+from dataclasses import dataclass
+from types import MappingProxyType
 from typing import Dict, Optional, List, Any, Callable, Awaitable
 import platform
 from datetime import datetime
@@ -17,13 +18,49 @@ try:
     import redis.asyncio as redis_async
     REDIS_AVAILABLE = True
 except ImportError:
-    # 如果导入失败，main.py中已提供了AsyncRedisWrapper的实现
-    from main import AsyncRedisWrapper
+    # 如果导入失败，使用redis_compat中基于同步客户端的兼容层
+    from redis_compat import AsyncRedisWrapper
     redis_async = AsyncRedisWrapper
     REDIS_AVAILABLE = False
 
+# orjson支持 - 可选，不可用时回退到标准json
+# 序列化结果只写入Redis，redis客户端同时接受bytes和str，因此直接使用orjson输出的bytes
+try:
+    import orjson
+    dumps = orjson.dumps
+    ORJSON_AVAILABLE = True
+except ImportError:
+    dumps = json.dumps
+    ORJSON_AVAILABLE = False
+
 logger = logging.getLogger("SystemMonitor")
 
+# 速率计算使用的计数器，样本元组中时间戳之后按此顺序排列
+RATE_SAMPLE_FIELDS = (
+    "messages_received",
+    "messages_sent",
+    "connections_opened",
+    "connections_closed",
+    "errors",
+    "requests"
+)
+
+# dataclass的slots参数需要Python 3.10+，低版本退回到普通实例字典
+DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(frozen=True, **DATACLASS_SLOTS)
+class MetricSample:
+    """一次指标更新的快照，只保留历史查询用到的标量，创建后不再修改"""
+    timestamp: float
+    system_cpu: float
+    process_cpu: float
+    memory_percent: float  # 进程内存占用百分比
+    connections: int
+    messages_received: int
+    messages_sent: int
+    errors: int
+    degradation_level: int
+
 class ChatSystemMonitor:
     """
     聊天系统性能监控模块，负责收集和报告系统性能指标
@@ -86,6 +123,12 @@ class ChatSystemMonitor:
                 else:
                     self.alert_threshold[key] = value
         
+        # 默认阈值已覆盖所有检查的指标，初始化后阈值不再变化，冻结为只读映射，
+        # 检查告警时无需再补全缺失的阈值
+        self.alert_threshold = MappingProxyType({
+            key: MappingProxyType(dict(value)) for key, value in self.alert_threshold.items()
+        })
+        
         # 指标数据
         self.metrics = {
             "start_time": time.time(),
@@ -115,7 +158,6 @@ class ChatSystemMonitor:
         
         # 计数器
         self.counters = defaultdict(int)
-        self._counter_lock = asyncio.Lock()
         
         # 任务
         self.monitoring_task = None
@@ -140,13 +182,28 @@ class ChatSystemMonitor:
         self.start_time = time.time()
         self.alert_states = {}
         self.fault_counters = defaultdict(int)
-        self.metrics_history = []
         self.max_history_size = 1000  # 最多保存1000条历史记录
-        self.samples = []
+        self.metrics_history = deque(maxlen=self.max_history_size)  # 超出容量时自动丢弃最旧的记录
+        self.samples = deque()
         self.rate_window = 60  # 1分钟速率窗口
+        self.last_rates = {}  # 最近一次指标更新时计算的速率，供监控循环复用
+        
+        # 同一类错误日志在该时间间隔（秒）内只记录一次，避免Redis反复故障时刷屏
+        self.error_log_interval = 60.0
+        self._log_last = {}
         self.last_net_io = None
         self.last_net_io_time = None
         
+        # CPU使用率采用非阻塞采样：cpu_percent(interval=None)返回距上次调用的平均值，
+        # 需要保留同一个Process对象并先调用一次作为基准
+        self._process = psutil.Process(os.getpid())
+        self._process.cpu_percent(interval=None)
+        psutil.cpu_percent(interval=None)
+        
+        # 开销较大且变化缓慢的指标（进程socket数、磁盘使用率）每隔若干次更新才重新采集
+        self.slow_metrics_interval = 6
+        self._slow_tick = 0
+        
         # 初始化子指标
         self.metrics["process"] = {
             "cpu_usage": 0.0,
@@ -191,6 +248,25 @@ class ChatSystemMonitor:
         
         logger.info(f"初始化监控系统，节点ID: {self.node_id}, 模式: {'分布式' if self.redis_client else '单机'}")
         
+    def _rate_log(self, level: int, key: str, msg: str, *args, exc_info: bool = False) -> None:
+        """
+        限频记录日志，日志级别未开启时不格式化消息和异常堆栈
+        
+        Args:
+            level: 日志级别
+            key: 限频的错误类别
+            msg: %格式的日志消息
+            *args: 日志消息参数
+            exc_info: 是否附带异常堆栈
+        """
+        if not logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        if now - self._log_last.get(key, -self.error_log_interval) < self.error_log_interval:
+            return
+        self._log_last[key] = now
+        logger.log(level, msg, *args, exc_info=exc_info)
+    
     def _get_node_id(self) -> str:
         """获取当前节点ID"""
         # 尝试获取环境变量中的节点ID
@@ -217,8 +293,75 @@ class ChatSystemMonitor:
             counter_name: 计数器名称
             value: 增加的值
         """
-        if counter_name in self.counters:
-            self.counters[counter_name] += value
+        # 计数器只在事件循环线程中同步更新，无需加锁；
+        # counters是defaultdict，首次出现的计数器从0开始累加
+        self.counters[counter_name] += value
+    
+    def _count_tcp_connections(self) -> int:
+        """
+        统计本进程的TCP连接数（含监听socket）
+        
+        Linux上先从/proc/<pid>/fd收集本进程持有的socket inode，再扫描/proc/<pid>/net/tcp和tcp6，
+        只统计inode属于本进程的行；/proc/<pid>/net/tcp*列出的是整个网络命名空间的socket，
+        不能直接数行数。不为每个socket解析地址和状态，开销远小于psutil的connections()。
+        其他平台回退到psutil的connections()
+        """
+        pid = self._process.pid
+        try:
+            inodes = set()
+            with os.scandir(f"/proc/{pid}/fd") as entries:
+                for entry in entries:
+                    try:
+                        target = os.readlink(entry.path)
+                    except OSError:
+                        continue  # 文件描述符在遍历期间已关闭
+                    if target.startswith("socket:["):
+                        inodes.add(target[8:-1])
+        except FileNotFoundError:
+            return len(self._process.connections())
+        
+        if not inodes:
+            return 0
+        
+        count = 0
+        for name in ("tcp", "tcp6"):
+            try:
+                with open(f"/proc/{pid}/net/{name}") as f:
+                    next(f, None)  # 跳过表头行
+                    for line in f:
+                        # 第10列为socket inode
+                        if line.split(None, 10)[9] in inodes:
+                            count += 1
+            except FileNotFoundError:
+                # 内核未启用IPv6时没有tcp6文件
+                continue
+        return count
+    
+    def _sample_system(self, refresh_slow: bool) -> tuple:
+        """
+        在线程池中执行的psutil同步采样
+        
+        Args:
+            refresh_slow: 是否同时采集连接数和磁盘使用率
+            
+        Returns:
+            采样结果元组，未采集的项为None
+        """
+        process = self._process
+        # 获取文件描述符数量（仅在Unix系统上可用）
+        file_descriptors = process.num_fds() if hasattr(process, 'num_fds') else None
+        return (
+            process.cpu_percent(interval=None),
+            process.memory_info(),
+            process.memory_percent(),
+            process.num_threads(),
+            file_descriptors,
+            self._count_tcp_connections() if refresh_slow else None,
+            psutil.cpu_percent(interval=None),
+            psutil.virtual_memory(),
+            psutil.disk_usage('/') if refresh_slow else None,
+            psutil.net_io_counters()
+        )
     
     def register_status_callback(self, callback: Callable[[Dict], Awaitable[None]]) -> None:
         """
@@ -245,49 +388,40 @@ class ChatSystemMonitor:
             
             logger.warning(f"系统状态变更: {change_type}, 降级级别: {old_level} -> {new_level}")
             
-            # 添加CPU监控信息
-            if "process" in self.metrics and "cpu_usage" in self.metrics["process"]:
-                new_status["process_cpu"] = self.metrics["process"]["cpu_usage"]
-            
-            if "system" in self.metrics and "cpu_usage" in self.metrics["system"]:
-                new_status["system_cpu"] = self.metrics["system"]["cpu_usage"]
-            
-            # 添加内存使用率信息
-            if "process" in self.metrics and "memory_percent" in self.metrics["process"]:
-                new_status["process_memory_percent"] = self.metrics["process"]["memory_percent"]
-            
-            if "system" in self.metrics and "memory_percent" in self.metrics["system"]:
-                new_status["system_memory_percent"] = self.metrics["system"]["memory_percent"]
+            # 添加CPU和内存使用率信息，子指标在__init__中已初始化，无需检查键是否存在
+            process_metrics = self.metrics["process"]
+            system_metrics = self.metrics["system"]
+            new_status["process_cpu"] = process_metrics["cpu_usage"]
+            new_status["system_cpu"] = system_metrics["cpu_usage"]
+            new_status["process_memory_percent"] = process_metrics["memory_percent"]
+            new_status["system_memory_percent"] = system_metrics["memory_percent"]
             
-            # 执行状态变更回调
+            # 并发执行状态变更回调，总耗时取决于最慢的回调而不是所有回调之和
             if self.status_callbacks:
-                for callback in self.status_callbacks:
-                    try:
-                        await callback(new_status)
-                    except Exception as e:
-                        logger.error(f"状态回调执行错误: {e.__class__.__name__}:{str(e)}")
-                        logger.debug(f"回调错误详情: {traceback.format_exc()}")
+                results = await asyncio.gather(
+                    *(callback(new_status) for callback in self.status_callbacks),
+                    return_exceptions=True
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.error(f"状态回调执行错误: {result.__class__.__name__}:{str(result)}")
+                        logger.debug("回调错误详情", exc_info=result)
             
-            # 发布状态变更事件
+            # 发布状态变更事件，设置超时
             if self.redis_client:
                 try:
-                    # 创建异步任务，避免阻塞
-                    async def publish_operation():
-                        try:
-                            await self.redis_client.publish(
-                                "system:status_change",
-                                json.dumps({
-                                    "node_id": self.node_id,
-                                    "timestamp": time.time(),
-                                    "old_status": old_status,
-                                    "new_status": new_status
-                                })
-                            )
-                        except Exception as e:
-                            logger.error(f"发布状态变更到Redis错误: {e}")
-                    
-                    # 设置超时
-                    await asyncio.wait_for(publish_operation(), timeout=1.0)
+                    await asyncio.wait_for(
+                        self.redis_client.publish(
+                            "system:status_change",
+                            dumps({
+                                "node_id": self.node_id,
+                                "timestamp": time.time(),
+                                "old_status": old_status,
+                                "new_status": new_status
+                            })
+                        ),
+                        timeout=1.0
+                    )
                 except asyncio.TimeoutError:
                     logger.warning("发布状态变更到Redis超时")
                 except Exception as e:
@@ -307,34 +441,37 @@ class ChatSystemMonitor:
             更新后的指标
         """
         try:
-            process = psutil.Process(os.getpid())
+            # 连接数和磁盘使用率开销较大，每slow_metrics_interval次更新才采集一次，其余时间沿用上次的值
+            refresh_slow = self._slow_tick % self.slow_metrics_interval == 0
+            self._slow_tick += 1
+            
+            # 所有psutil采样都要读取/proc，合并为一次提交到线程池执行，不占用事件循环
+            (process_cpu, memory_info, memory_percent, threads, file_descriptors,
+             connections, system_cpu, virtual_memory, disk, current_net_io) = \
+                await asyncio.get_running_loop().run_in_executor(None, self._sample_system, refresh_slow)
+            current_time = time.time()
             
             # 更新进程指标
             process_metrics = self.metrics["process"]
-            process_metrics["cpu_usage"] = process.cpu_percent(interval=0.1)
-            memory_info = process.memory_info()
+            process_metrics["cpu_usage"] = process_cpu
             process_metrics["memory_usage"] = memory_info.rss
-            process_metrics["memory_percent"] = process.memory_percent()
-            process_metrics["connections"] = len(process.connections())
-            process_metrics["threads"] = process.num_threads()
-            
-            # 获取文件描述符数量（仅在Unix系统上可用）
-            if hasattr(process, 'num_fds'):
-                process_metrics["file_descriptors"] = process.num_fds()
+            process_metrics["memory_percent"] = memory_percent
+            process_metrics["threads"] = threads
+            if connections is not None:
+                process_metrics["connections"] = connections
+            if file_descriptors is not None:
+                process_metrics["file_descriptors"] = file_descriptors
             
             # 更新系统指标
             system_metrics = self.metrics["system"]
-            system_metrics["cpu_usage"] = psutil.cpu_percent(interval=0.1)
-            virtual_memory = psutil.virtual_memory()
+            system_metrics["cpu_usage"] = system_cpu
             system_metrics["memory_total"] = virtual_memory.total
             system_metrics["memory_available"] = virtual_memory.available
             system_metrics["memory_percent"] = virtual_memory.percent
-            disk = psutil.disk_usage('/')
-            system_metrics["disk_usage"] = disk.percent
+            if disk is not None:
+                system_metrics["disk_usage"] = disk.percent
             
             # 更新网络IO指标
-            current_net_io = psutil.net_io_counters()
-            current_time = time.time()
             
             if self.last_net_io and self.last_net_io_time:
                 # 计算变化量
@@ -379,21 +516,31 @@ class ChatSystemMonitor:
             # 更新时间戳
             self.metrics["timestamp"] = time.time()
             
-            # 保存历史指标
-            if len(self.metrics_history) >= self.max_history_size:
-                self.metrics_history.pop(0)
-            self.metrics_history.append(self.metrics.copy())
+            # 保存历史指标：self.metrics中的嵌套字典会被原地更新，因此记录独立的标量快照
+            application = self.metrics["application"]
+            self.metrics_history.append(MetricSample(
+                timestamp=self.metrics["timestamp"],
+                system_cpu=system_metrics["cpu_usage"],
+                process_cpu=process_metrics["cpu_usage"],
+                memory_percent=process_metrics["memory_percent"],
+                connections=application["active_connections"],
+                messages_received=application["messages_received"],
+                messages_sent=application["messages_sent"],
+                errors=application["errors"],
+                degradation_level=self.metrics["status"]["degradation_level"]
+            ))
             
             # 将数据保存到Redis
             await self._save_to_redis()
             
-            # 每次更新指标后检查告警状态
-            await self._check_alerts()
+            # 每次更新指标后计算一次速率，告警检查和监控循环共用该结果
+            self.last_rates = await self.calculate_rates()
+            await self._check_alerts(self.last_rates)
             
             return self.metrics
         
         except Exception as e:
-            logger.error(f"更新指标错误: {traceback.format_exc()}")
+            self._rate_log(logging.ERROR, "update_metrics", "更新指标错误: %s", e, exc_info=True)
             self.increment_counter("errors")
             self.metrics["status"]["last_error"] = str(e)
             self.metrics["status"]["last_error_time"] = time.time()
@@ -409,48 +556,62 @@ class ChatSystemMonitor:
             # 使用超时机制，避免阻塞太久
             async def save_operation():
                 # 更新指标时间戳
-                self.metrics["last_update"] = time.time()
+                now = time.time()
+                self.metrics["last_update"] = now
                 
-                # 序列化指标数据
-                metrics_json = json.dumps(self.metrics)
+                # 只发布其他节点关心的节点摘要，完整的嵌套指标保留在本地
+                process_metrics = self.metrics["process"]
+                system_metrics = self.metrics["system"]
+                status = self.metrics["status"]
+                metrics_json = dumps({
+                    "node_id": self.node_id,
+                    "cpu_usage": max(process_metrics["cpu_usage"], system_metrics["cpu_usage"]),
+                    "memory_usage": process_metrics["memory_percent"],
+                    "connections": self.metrics["application"]["active_connections"],
+                    "degradation_level": status["degradation_level"],
+                    "is_healthy": status["is_healthy"],
+                    "last_update": now
+                })
+                
+                # 所有命令放入同一个非事务管道，一次往返发送
+                pipe = self.redis_client.pipeline(transaction=False)
                 
                 # 将指标保存到Redis哈希表
-                await self.redis_client.hset(
+                pipe.hset(
                     "monitor:nodes", 
                     self.node_id, 
                     metrics_json
                 )
                 
                 # 设置过期时间（30分钟）
-                await self.redis_client.expire("monitor:nodes", 1800)
+                pipe.expire("monitor:nodes", 1800)
                 
                 # 向活跃节点集合添加当前节点
-                await self.redis_client.sadd("monitor:active_nodes", self.node_id)
-                await self.redis_client.expire("monitor:active_nodes", 1800)
+                pipe.sadd("monitor:active_nodes", self.node_id)
+                pipe.expire("monitor:active_nodes", 1800)
                 
                 # 保存历史数据
                 for metric_name, values in self.history.items():
                     if values:
                         key = f"monitor:history:{self.node_id}:{metric_name}"
-                        # 添加最新值到历史列表
-                        await self.redis_client.lpush(key, values[-1])
+                        # 添加最新值到历史列表，历史序列中只保存数值
+                        pipe.lpush(key, values[-1])
                         # 限制列表长度
-                        await self.redis_client.ltrim(key, 0, 599)  # 保留最近600个值（10小时，如果每分钟一个值）
+                        pipe.ltrim(key, 0, 599)  # 保留最近600个值（10小时，如果每分钟一个值）
                         # 设置过期时间
-                        await self.redis_client.expire(key, 86400)  # 1天
+                        pipe.expire(key, 86400)  # 1天
+                
+                await pipe.execute()
             
             # 设置超时
             try:
                 await asyncio.wait_for(save_operation(), timeout=2.0)
             except asyncio.TimeoutError:
-                if random.random() < 0.1:  # 降低日志频率
-                    logger.warning("保存指标到Redis超时")
+                self._rate_log(logging.WARNING, "save_timeout", "保存指标到Redis超时")
                 return
                 
         except Exception as e:
-            # 降低错误日志频率
-            if random.random() < 0.1:  # 只有10%的错误会被记录
-                logger.error(f"保存指标到Redis失败: {e}")
+            self._rate_log(logging.ERROR, "save_error", "保存指标到Redis失败: %s", e)
             return
     
     async def calculate_rates(self) -> Dict:
@@ -462,22 +623,16 @@ class ChatSystemMonitor:
         """
         try:
             current_time = time.time()
-            current_sample = {
-                "timestamp": current_time,
-                "messages_received": self.counters["messages_received"],
-                "messages_sent": self.counters["messages_sent"],
-                "connections_opened": self.counters["connections_opened"],
-                "connections_closed": self.counters["connections_closed"],
-                "errors": self.counters["errors"],
-                "requests": self.counters["requests"]
-            }
+            counters = self.counters
+            # 样本按RATE_SAMPLE_FIELDS顺序存为元组，第一个元素为时间戳
+            current_sample = (current_time,) + tuple(counters[name] for name in RATE_SAMPLE_FIELDS)
             
             # 添加新样本
             self.samples.append(current_sample)
             
             # 移除过期样本
-            while self.samples and current_time - self.samples[0]["timestamp"] > self.rate_window:
-                self.samples.pop(0)
+            while self.samples and current_time - self.samples[0][0] > self.rate_window:
+                self.samples.popleft()
             
             if len(self.samples) < 2:
                 return {
@@ -490,7 +645,7 @@ class ChatSystemMonitor:
             
             # 计算速率
             oldest = self.samples[0]
-            time_diff = current_time - oldest["timestamp"]
+            time_diff = current_time - oldest[0]
             
             if time_diff <= 0:
                 return {
@@ -501,12 +656,10 @@ class ChatSystemMonitor:
                     "request_rate": 0
                 }
                 
-            messages_received_diff = current_sample["messages_received"] - oldest["messages_received"]
-            messages_sent_diff = current_sample["messages_sent"] - oldest["messages_sent"]
-            connections_opened_diff = current_sample["connections_opened"] - oldest["connections_opened"]
-            connections_closed_diff = current_sample["connections_closed"] - oldest["connections_closed"]
-            errors_diff = current_sample["errors"] - oldest["errors"]
-            requests_diff = current_sample["requests"] - oldest["requests"]
+            (messages_received_diff, messages_sent_diff, connections_opened_diff,
+             connections_closed_diff, errors_diff, requests_diff) = (
+                current - old for current, old in zip(current_sample[1:], oldest[1:])
+            )
             
             # 计算错误率
             error_rate = 0
@@ -539,25 +692,27 @@ class ChatSystemMonitor:
                 "request_rate": 0
             }
     
-    async def _check_alerts(self) -> None:
-        """检查系统指标是否超过告警阈值"""
+    async def _check_alerts(self, rates: Dict = None) -> None:
+        """
+        检查系统指标是否超过告警阈值
+        
+        Args:
+            rates: 本次更新已计算的速率，未提供时重新计算
+        """
         try:
-            # 获取当前指标
-            cpu_usage = max(self.metrics["process"]["cpu_usage"], self.metrics["system"]["cpu_usage"])
-            memory_usage = max(self.metrics["process"]["memory_percent"], self.metrics["system"]["memory_percent"])
+            # 获取当前指标，本次检查中只计算一次
+            metrics = self.metrics
+            process_metrics = metrics["process"]
+            system_metrics = metrics["system"]
+            status = metrics["status"]
+            cpu_usage = max(process_metrics["cpu_usage"], system_metrics["cpu_usage"])
+            memory_usage = max(process_metrics["memory_percent"], system_metrics["memory_percent"])
             
             # 计算错误率
-            rates = await self.calculate_rates()
+            if rates is None:
+                rates = await self.calculate_rates()
             error_rate = rates.get("error_rate", 0)  # 使用get方法避免KeyError
             
-            # 确保所有必要的阈值键存在
-            for key in ["cpu_usage", "memory_usage", "error_rate"]:
-                if key not in self.alert_threshold:
-                    self.alert_threshold[key] = {"warning": 0.7, "critical": 0.9}
-                    if key == "error_rate":
-                        self.alert_threshold[key] = {"warning": 0.1, "critical": 0.3}
-                    logger.warning(f"添加缺失的告警阈值: {key}")
-            
             # 检查CPU告警
             await self._check_alert_threshold("cpu_usage", cpu_usage)
             
@@ -576,29 +731,32 @@ class ChatSystemMonitor:
                     logger.error(f"Redis延迟检查失败: {e}")
             
             # 更新健康状态
-            old_health_status = self.metrics["status"]["is_healthy"]
-            old_degradation = self.metrics["status"]["degradation_level"]
+            old_health_status = status["is_healthy"]
+            old_degradation = status["degradation_level"]
             
             # 判断健康状态
             is_healthy = True
             degradation_level = 0
+            cpu_threshold = self.alert_threshold["cpu_usage"]
+            memory_threshold = self.alert_threshold["memory_usage"]
+            error_threshold = self.alert_threshold["error_rate"]
             
             # 检查CPU和内存是否处于危急状态
-            if (cpu_usage >= self.alert_threshold["cpu_usage"]["critical"] or 
-                memory_usage >= self.alert_threshold["memory_usage"]["critical"] or
-                error_rate >= self.alert_threshold.get("error_rate", {}).get("critical", 0.3)):
+            if (cpu_usage >= cpu_threshold["critical"] or 
+                memory_usage >= memory_threshold["critical"] or
+                error_rate >= error_threshold.get("critical", 0.3)):
                 is_healthy = False
                 degradation_level = 3  # 严重降级
             # 检查是否处于警告状态
-            elif (cpu_usage >= self.alert_threshold["cpu_usage"]["warning"] or 
-                  memory_usage >= self.alert_threshold["memory_usage"]["warning"] or
-                  error_rate >= self.alert_threshold.get("error_rate", {}).get("warning", 0.1)):
+            elif (cpu_usage >= cpu_threshold["warning"] or 
+                  memory_usage >= memory_threshold["warning"] or
+                  error_rate >= error_threshold.get("warning", 0.1)):
                 is_healthy = True  # 仍然健康，但处于警告状态
                 degradation_level = 1  # 轻度降级
             
             # 更新健康状态
-            self.metrics["status"]["is_healthy"] = is_healthy
-            self.metrics["status"]["degradation_level"] = degradation_level
+            status["is_healthy"] = is_healthy
+            status["degradation_level"] = degradation_level
             
             # 如果健康状态或降级级别发生变化，通知回调
             if old_health_status != is_healthy or old_degradation != degradation_level:
@@ -642,9 +800,7 @@ class ChatSystemMonitor:
                 return 9999.0  # 返回一个大值表示错误
                 
         except Exception as e:
-            # 减少日志输出频率，避免日志爆炸
-            if random.random() < 0.1:  # 只有10%的错误会被记录
-                logger.error(f"Redis延迟检查错误: {e}")
+            self._rate_log(logging.ERROR, "redis_latency", "Redis延迟检查错误: %s", e)
             self.fault_counters["redis_errors"] += 1
             return 9999.0  # 返回一个大值表示错误
     
@@ -659,16 +815,6 @@ class ChatSystemMonitor:
         Returns:
             是否触发告警
         """
-        # 确保告警阈值存在
-        if metric_name not in self.alert_threshold:
-            # 设置默认阈值
-            if metric_name == "error_rate":
-                self.alert_threshold[metric_name] = {"warning": 0.1, "critical": 0.3}
-            else:
-                self.alert_threshold[metric_name] = {"warning": 0.7, "critical": 0.9}
-            
-            logger.warning(f"为指标 {metric_name} 设置默认告警阈值")
-        
         # 获取告警阈值
         thresholds = self.alert_threshold[metric_name]
         
@@ -732,8 +878,8 @@ class ChatSystemMonitor:
                 # 更新指标
                 await self.update_metrics()
                 
-                # 计算速率
-                rates = await self.calculate_rates()
+                # 复用本次指标更新时计算的速率
+                rates = self.last_rates
                 
                 # 每分钟输出一次日志
                 if int(time.time()) % 60 < self.check_interval:
@@ -741,7 +887,7 @@ class ChatSystemMonitor:
                     process_cpu = self.metrics["process"]["cpu_usage"]
                     memory_percent = self.metrics["process"]["memory_percent"]
                     connections = self.metrics["application"]["active_connections"]
-                    msg_rate = rates["messages_received_rate"]
+                    msg_rate = rates.get("messages_received_rate", 0)
                     
                     logger.info(
                         f"系统状态 - CPU: {system_cpu:.1f}%, 进程CPU: {process_cpu:.1f}%, "
@@ -754,7 +900,7 @@ class ChatSystemMonitor:
         except asyncio.CancelledError:
             logger.info("监控任务被取消")
         except Exception as e:
-            logger.error(f"监控任务错误: {traceback.format_exc()}")
+            logger.error("监控任务错误: %s", e, exc_info=True)
             self.metrics["status"]["is_healthy"] = False
             self.metrics["status"]["last_error"] = str(e)
             self.metrics["status"]["last_error_time"] = time.time()
@@ -843,10 +989,6 @@ class ChatSystemMonitor:
                 # 每小时执行一次清理
                 await asyncio.sleep(3600)
                 
-                # 清理历史指标，避免内存泄漏
-                if len(self.metrics_history) > self.max_history_size:
-                    self.metrics_history = self.metrics_history[-self.max_history_size:]
-                
                 # 检查并清理Redis中过期的节点
                 if self.redis_client:
                     try:
@@ -1005,7 +1147,7 @@ class ChatSystemMonitor:
                 await self.redis_client.hdel("monitor:nodes:last_seen", self.node_id)
                 
                 # 发布下线通知
-                await self.redis_client.publish("system:node_offline", json.dumps({
+                await self.redis_client.publish("system:node_offline", dumps({
                     "node_id": self.node_id,
                     "timestamp": time.time()
                 }))
@@ -1063,7 +1205,7 @@ class ChatSystemMonitor:
                 await self.redis_client.hdel("monitor:nodes:last_seen", self.node_id)
                 
                 # 发布下线通知
-                await self.redis_client.publish("system:node_offline", json.dumps({
+                await self.redis_client.publish("system:node_offline", dumps({
                     "node_id": self.node_id,
                     "timestamp": time.time()
                 }))
@@ -1100,10 +1242,10 @@ class ChatSystemMonitor:
         
         # 过滤数据
         for entry in self.metrics_history:
-            if entry["timestamp"] >= start_time:
-                result["timestamps"].append(entry["timestamp"])
-                result["cpu"].append(max(entry["process"]["cpu_usage"], entry["system"]["cpu_usage"]))
-                result["memory"].append(entry["process"]["memory_percent"])
-                result["connections"].append(entry["application"]["active_connections"])
+            if entry.timestamp >= start_time:
+                result["timestamps"].append(entry.timestamp)
+                result["cpu"].append(max(entry.process_cpu, entry.system_cpu))
+                result["memory"].append(entry.memory_percent)
+                result["connections"].append(entry.connections)
                 
         return result 
\ No newline at end of file
@@ -0,0 +1,363 @@
+"""
+旧版redis-py（没有redis.asyncio模块）的异步兼容层
+
+将同步客户端的命令提交到每个客户端专用的单线程执行器中运行，
+仅在main.py导入redis.asyncio失败时才会被导入。
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+logger = logging.getLogger("RedisCompat")
+
+HIREDIS_AVAILABLE = getattr(redis.connection, "HIREDIS_AVAILABLE", False)
+
+class AsyncRedisPipelineWrapper:
+    """Redis Pipeline的异步包装器"""
+
+    def __init__(self, pipeline, loop=None, executor=None):
+        self._pipeline = pipeline
+        self._loop = loop  # 由父客户端传入缓存的事件循环，未传入时首次执行时获取
+        self._executor = executor
+
+    async def execute(self):
+        """执行管道中的所有命令"""
+        def _execute():
+            return self._pipeline.execute()
+        return await self._run_in_executor(_execute)
+
+    async def _run_in_executor(self, func):
+        loop = self._loop
+        if loop is None:
+            loop = self._loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func)
+
+    # 支持管道操作
+    def __getattr__(self, name):
+        # 获取原始pipeline的方法
+        attr = getattr(self._pipeline, name)
+        if not callable(attr):
+            return attr
+
+        # 如果是方法，返回一个包装器，让管道可以链式调用
+        pipeline = self._pipeline
+        def wrapper(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # 如果返回的是pipeline本身（链式调用），返回self
+            return self if result is pipeline else result
+
+        # 缓存到实例字典，之后同名命令直接命中，不再进入__getattr__
+        self.__dict__[name] = wrapper
+        return wrapper
+
+class AsyncPubSubWrapper:
+    """Redis PubSub对象的异步包装器"""
+
+    def __init__(self, pubsub, loop=None, executor=None):
+        self._pubsub = pubsub
+        self._loop = loop  # 由父客户端传入缓存的事件循环，未传入时首次执行时获取
+        self._executor = executor
+
+    async def subscribe(self, *channels):
+        """订阅频道"""
+        def _subscribe():
+            return self._pubsub.subscribe(*channels)
+        return await self._run_in_executor(_subscribe)
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=0):
+        """获取消息"""
+        def _get_message():
+            return self._pubsub.get_message(
+                ignore_subscribe_messages=ignore_subscribe_messages,
+                timeout=timeout
+            )
+        return await self._run_in_executor(_get_message)
+
+    async def unsubscribe(self, *channels):
+        """取消订阅频道"""
+        def _unsubscribe():
+            return self._pubsub.unsubscribe(*channels)
+        return await self._run_in_executor(_unsubscribe)
+
+    async def close(self):
+        """关闭PubSub连接"""
+        def _close():
+            return self._pubsub.close()
+        return await self._run_in_executor(_close)
+
+    async def _run_in_executor(self, func):
+        loop = self._loop
+        if loop is None:
+            loop = self._loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func)
+
+class AsyncRedisWrapper:
+    """Redis异步API的兼容包装器，将同步Redis API包装成异步接口"""
+
+    def __init__(self, url=None, host='localhost', port=6379, username=None, password=None, **kwargs):
+        """初始化Redis包装器
+
+        参数:
+            url: Redis连接URL
+            host: Redis主机名
+            port: Redis端口
+            username: Redis用户名
+            password: Redis密码
+            **kwargs: 其他Redis连接参数
+        """
+        try:
+            import redis as sync_redis_lib
+            if url:
+                self._redis = sync_redis_lib.from_url(url, **kwargs)
+            else:
+                self._redis = sync_redis_lib.Redis(
+                    host=host, 
+                    port=port,
+                    username=username,
+                    password=password,
+                    **kwargs
+                )
+            # 在事件循环中创建时直接缓存，否则在首次执行命令时获取
+            try:
+                self._loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._loop = None
+            # 所有命令都提交到同一个专用线程，避免占用默认线程池
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="redis-wrapper")
+        except Exception as e:
+            logger = logging.getLogger("AsyncRedisWrapper")
+            logger.error(f"Redis客户端创建失败: {str(e)}")
+            raise
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """从URL创建Redis连接
+
+        这是一个类方法，兼容redis.asyncio.Redis.from_url的接口
+        """
+        return cls(url, **kwargs)
+
+    async def ping(self):
+        """测试Redis连接"""
+        def _ping():
+            return self._redis.ping()
+        return await self._run_in_executor(_ping)
+
+    async def get(self, key):
+        """获取键值"""
+        def _get():
+            return self._redis.get(key)
+        return await self._run_in_executor(_get)
+
+    async def set(self, key, value, **kwargs):
+        """设置键值"""
+        def _set():
+            return self._redis.set(key, value, **kwargs)
+        return await self._run_in_executor(_set)
+
+    async def delete(self, *keys):
+        """删除键"""
+        def _delete():
+            return self._redis.delete(*keys)
+        return await self._run_in_executor(_delete)
+
+    async def exists(self, *keys):
+        """检查键是否存在"""
+        def _exists():
+            return self._redis.exists(*keys)
+        return await self._run_in_executor(_exists)
+
+    async def expire(self, key, seconds):
+        """设置键过期时间"""
+        def _expire():
+            return self._redis.expire(key, seconds)
+        return await self._run_in_executor(_expire)
+
+    async def ttl(self, key):
+        """获取键剩余生存时间"""
+        def _ttl():
+            return self._redis.ttl(key)
+        return await self._run_in_executor(_ttl)
+
+    async def hset(self, name, key=None, value=None, mapping=None):
+        """设置哈希表中的字段值"""
+        def _hset():
+            if mapping is not None:
+                return self._redis.hset(name, mapping=mapping)
+            else:
+                return self._redis.hset(name, key, value)
+        return await self._run_in_executor(_hset)
+
+    async def hget(self, name, key):
+        """获取哈希表字段值"""
+        def _hget():
+            return self._redis.hget(name, key)
+        return await self._run_in_executor(_hget)
+
+    async def hgetall(self, name):
+        """获取哈希表所有字段和值"""
+        def _hgetall():
+            return self._redis.hgetall(name)
+        return await self._run_in_executor(_hgetall)
+
+    async def publish(self, channel, message):
+        """发布消息到频道"""
+        def _publish():
+            return self._redis.publish(channel, message)
+        return await self._run_in_executor(_publish)
+
+    async def _run_in_executor(self, func):
+        """在专用执行器中运行同步函数"""
+        loop = self._loop
+        if loop is None:
+            loop = self._loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func)
+
+    # 添加额外需要的方法
+    async def keys(self, pattern):
+        """查找所有符合给定模式的键"""
+        def _keys():
+            return self._redis.keys(pattern)
+        return await self._run_in_executor(_keys)
+
+    async def batch(self, ops):
+        """在一次执行器提交中顺序执行多个命令
+
+        参数:
+            ops: (方法名, args, kwargs) 元组列表
+        """
+        def _batch():
+            return [getattr(self._redis, name)(*args, **kwargs) for name, args, kwargs in ops]
+        return await self._run_in_executor(_batch)
+
+    async def scan_iter(self, match=None, count=None):
+        """增量遍历符合模式的键，每批SCAN在执行器中运行，不阻塞Redis"""
+        cursor = "0"
+        while cursor != 0:
+            def _scan():
+                return self._redis.scan(cursor=cursor, match=match, count=count)
+            cursor, keys = await self._run_in_executor(_scan)
+            for key in keys:
+                yield key
+
+    async def hincrby(self, name, key, amount=1):
+        """为哈希表指定字段的整数值加上增量"""
+        def _hincrby():
+            return self._redis.hincrby(name, key, amount)
+        return await self._run_in_executor(_hincrby)
+
+    async def sadd(self, name, *values):
+        """向集合添加一个或多个成员"""
+        def _sadd():
+            return self._redis.sadd(name, *values)
+        return await self._run_in_executor(_sadd)
+
+    async def smembers(self, name):
+        """返回集合中的所有成员"""
+        def _smembers():
+            return self._redis.smembers(name)
+        return await self._run_in_executor(_smembers)
+
+    async def srem(self, name, *values):
+        """移除集合中一个或多个成员"""
+        def _srem():
+            return self._redis.srem(name, *values)
+        return await self._run_in_executor(_srem)
+
+    async def hdel(self, name, *keys):
+        """删除一个或多个哈希表字段"""
+        def _hdel():
+            return self._redis.hdel(name, *keys)
+        return await self._run_in_executor(_hdel)
+
+    async def lpush(self, name, *values):
+        """将一个或多个值插入到列表头部"""
+        def _lpush():
+            return self._redis.lpush(name, *values)
+        return await self._run_in_executor(_lpush)
+
+    async def ltrim(self, name, start, end):
+        """对一个列表进行修剪(trim)"""
+        def _ltrim():
+            return self._redis.ltrim(name, start, end)
+        return await self._run_in_executor(_ltrim)
+
+    async def lrange(self, name, start, end):
+        """获取列表指定范围内的元素"""
+        def _lrange():
+            return self._redis.lrange(name, start, end)
+        return await self._run_in_executor(_lrange)
+
+    async def scard(self, name):
+        """获取集合的成员数"""
+        def _scard():
+            return self._redis.scard(name)
+        return await self._run_in_executor(_scard)
+
+    async def zrevrange(self, name, start, end, withscores=False):
+        """返回有序集合中指定区间内的成员，分数从高到低排序"""
+        def _zrevrange():
+            return self._redis.zrevrange(name, start, end, withscores=withscores)
+        return await self._run_in_executor(_zrevrange)
+
+    async def eval(self, script, keys=None, args=None):
+        """执行Lua脚本"""
+        def _eval():
+            return self._redis.eval(script, len(keys) if keys else 0, *(keys or []) + (args or []))
+        return await self._run_in_executor(_eval)
+
+    def pipeline(self, transaction=True):
+        """创建一个管道"""
+        # 创建一个简单的异步管道实现
+        pipe = self._redis.pipeline(transaction=transaction)
+        wrapper = AsyncRedisPipelineWrapper(pipe, self._loop, self._executor)
+        return wrapper
+
+    async def close(self):
+        """关闭Redis连接"""
+        result = self._redis.close()
+        self._executor.shutdown(wait=False)
+        return result
+
+    async def wait_closed(self):
+        """等待Redis连接关闭完成"""
+        # 同步客户端没有wait_closed方法，返回None即可
+        return None
+
+    # 添加pubsub方法
+    def pubsub(self):
+        """获取PubSub对象"""
+        pubsub = self._redis.pubsub()
+        return AsyncPubSubWrapper(pubsub, self._loop, self._executor)
+
+    async def zadd(self, name, mapping):
+        """添加到有序集合"""
+        def _zadd():
+            return self._redis.zadd(name, mapping)
+        return await self._run_in_executor(_zadd)
+
+    async def zremrangebyrank(self, name, start, end):
+        """删除有序集合中指定排名范围内的所有成员"""
+        def _zremrangebyrank():
+            return self._redis.zremrangebyrank(name, start, end)
+        return await self._run_in_executor(_zremrangebyrank)
+
+    async def xadd(self, name, fields, id='*', maxlen=None, approximate=True):
+        """向消息流追加一条消息"""
+        def _xadd():
+            return self._redis.xadd(name, fields, id=id, maxlen=maxlen, approximate=approximate)
+        return await self._run_in_executor(_xadd)
+
+    async def xrevrange(self, name, max='+', min='-', count=None):
+        """按ID从大到小返回消息流中指定范围内的消息"""
+        def _xrevrange():
+            return self._redis.xrevrange(name, max=max, min=min, count=count)
+        return await self._run_in_executor(_xrevrange)
+
+    async def type(self, key):
+        """获取键的类型"""
+        def _type():
+            return self._redis.type(key)
+        return await self._run_in_executor(_type)
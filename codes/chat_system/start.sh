@@ -125,8 +125,7 @@ starlette==0.27.0
 websockets==11.0.3
 jinja2==3.1.2
 python-dotenv==1.0.0
-redis==3.5.3  # 固定版本以兼容redis-py-cluster
-redis-py-cluster==2.1.3  # 集群支持(如果可用)
+redis[hiredis]==5.0.1  # 原生异步客户端，集群支持已内置
 httpx==0.24.1
 ujson==5.8.0
 psutil==5.9.5
@@ -143,7 +142,7 @@ else
 # 最小依赖集
 fastapi==0.95.2
 uvicorn==0.22.0
-redis==3.5.3  # 降级到与redis-py-cluster兼容的版本
+redis[hiredis]==5.0.1
 jinja2==3.1.2
 python-dotenv==1.0.0
 pydantic==1.10.8
@@ -172,6 +171,14 @@ if [ "$(python3 -c 'import sys; print(sys.version_info >= (3, 12))')" = "True" ]
     export MINIMAL_DEPS=1
 fi
 
+# Uvicorn命令行默认自动选择事件循环（已安装uvloop时即使用），禁用uvloop时需显式指定asyncio
+if [ "$DISABLE_UVLOOP" = "1" ]; then
+    UVICORN_LOOP="asyncio"
+else
+    UVICORN_LOOP="uvloop"
+    python3 -c 'import uvloop' 2>/dev/null || UVICORN_LOOP="asyncio"
+fi
+
 # 判断是否使用单机模式
 if [ -z "$REDIS_URL" ]; then
     warn "未设置 REDIS_URL 环境变量，将使用单机模式"
@@ -259,7 +266,7 @@ if [ "$MODE" == "single" ]; then
         info "使用日志级别: info"
         
         # 启动服务，添加-v参数增加详细度
-        python3 -m uvicorn main:app --host $HOST --port $PORT --log-level info --reload &
+        python3 -m uvicorn main:app --host $HOST --port $PORT --log-level info --loop $UVICORN_LOOP --ws websockets --ws-per-message-deflate false --reload &
         APP_PID=$!
         echo $APP_PID >> "$PID_FILE"
         info "服务已启动 (PID: $APP_PID)"
@@ -292,7 +299,7 @@ else
         info "在MacOS上使用Uvicorn启动单进程模式..."
         
         # 启动服务
-        python3 -m uvicorn main:app --host $HOST --port $PORT --log-level info --reload &
+        python3 -m uvicorn main:app --host $HOST --port $PORT --log-level info --loop $UVICORN_LOOP --ws websockets --ws-per-message-deflate false --reload &
         APP_PID=$!
         echo $APP_PID >> "$PID_FILE"
         info "服务已启动 (PID: $APP_PID)"